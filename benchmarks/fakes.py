@@ -0,0 +1,337 @@
+"""Local stand-ins for the Coursera GraphQL endpoint, Cloud Storage and BigQuery.
+
+These only implement the calls made by extract_function/main.py and
+load_function/main.py, and count the bytes they move so benchmarks can
+report them. Nothing here talks to the network except the local server;
+Cloud Storage objects are kept in a temporary directory.
+"""
+import atexit
+import datetime
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Bytes moved through the fakes since the last reset_counters()
+COUNTERS = {"gcs_bytes_written": 0, "gcs_bytes_read": 0, "graphql_bytes_served": 0, "bq_rows_loaded": 0}
+_counters_lock = threading.Lock()
+
+def count(name, value):
+    with _counters_lock:
+        COUNTERS[name] += value
+
+def reset_counters():
+    with _counters_lock:
+        for name in COUNTERS:
+            COUNTERS[name] = 0
+
+TYPENAMES = ["DiscoveryCollections_specialization", "DiscoveryCollections_professionalCertificate"]
+DIFFICULTIES = ["BEGINNER", "INTERMEDIATE", "ADVANCED", "MIXED"]
+
+def make_entity(i, rng, partners, reject_ratio=0.01):
+    """Build one synthetic DiscoveryCollections entity shaped like the live API's."""
+    typename = TYPENAMES[i % len(TYPENAMES)]
+    chosen = rng.sample(partners, rng.randint(1, 3))
+    entity = {
+        "__typename": typename,
+        "id": f"s~{i:08d}",
+        "slug": f"synthetic-course-{i}",
+        "name": f"Synthetic Course {i}",
+        "url": f"/specializations/synthetic-course-{i}",
+        "partnerIds": [p["id"] for p in chosen],
+        "imageUrl": f"https://example.invalid/images/{i}.png",
+        "partners": [dict(p, __typename="DiscoveryCollections_partner") for p in chosen],
+        "difficultyLevel": DIFFICULTIES[i % len(DIFFICULTIES)],
+        "isPartOfCourseraPlus": rng.random() < 0.6,
+        "productCard": {"id": f"pc~{i}", "marketingProductType": "SPECIALIZATION", "__typename": "ProductCard_ProductCard"}
+    }
+    if typename.endswith("specialization"):
+        entity["courseCount"] = rng.randint(2, 10)
+    if rng.random() < reject_ratio:
+        # Course cards carry no difficulty level and are rejected by clean_data
+        entity["__typename"] = "DiscoveryCollections_course"
+        del entity["difficultyLevel"]
+    return entity
+
+def iter_entities(n, seed=0, reject_ratio=0.01):
+    """Generate n synthetic entities deterministically from seed, one at a time."""
+    rng = random.Random(seed)
+    partners = [{"id": str(p), "name": f"Partner {p}", "logo": f"https://example.invalid/logos/{p}.png"}
+                for p in range(max(10, n // 100))]
+    for i in range(n):
+        yield make_entity(i, rng, partners, reject_ratio)
+
+def make_entities(n, seed=0, reject_ratio=0.01):
+    """Build n synthetic entities deterministically from seed."""
+    return list(iter_entities(n, seed, reject_ratio))
+
+def make_response(entities, collection_size=1000):
+    """Wrap entities in a DiscoveryCollections response, split into collections of collection_size."""
+    collections = [{
+        "__typename": "DiscoveryCollections_productCollection",
+        "id": f"collection~{start}",
+        "label": f"Collection {start}",
+        "linkedCollectionPageMetadata": None,
+        "entities": entities[start:start + collection_size]
+    } for start in range(0, len(entities), collection_size)]
+    return {"data": {"DiscoveryCollections": {"queryCollections": collections, "__typename": "DiscoveryCollections_DiscoveryCollectionsQuery"}}}
+
+def make_details_response(variables):
+    """Answer an aliased CourseDetails query with synthetic details for every id variable."""
+    return {"data": {"d" + name[len("id"):]: {
+        "id": entity_id,
+        "description": f"Details of {entity_id}",
+        "averageRating": 4.5,
+        "enrollmentCount": len(entity_id) * 1000,
+        "skills": ["Synthetic"]
+    } for name, entity_id in variables.items()}}
+
+class FakeGraphQLServer:
+    """Serve pre-rendered DiscoveryCollections responses from a local HTTP server.
+
+    responses maps contextId to the response body; unknown contexts get the
+    body registered under None. CourseDetails queries are answered for every
+    id they ask for.
+    """
+
+    def __init__(self, responses):
+        self.bodies = {context: json.dumps(body).encode("utf-8") for context, body in responses.items()}
+        bodies = self.bodies
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if payload.get("operationName") == "CourseDetails":
+                    # Aliased detail query: one d<i> field per id variable
+                    body = json.dumps(make_details_response(payload["variables"])).encode("utf-8")
+                else:
+                    context_id = payload.get("variables", {}).get("contextId")
+                    body = bodies.get(context_id, bodies.get(None, b'{"data": null}'))
+                count("graphql_bytes_served", len(body))
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d/graphql-gateway" % self.server.server_address[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+# Object store shared by every FakeStorageClient. Objects are files named after the quoted object
+# name under FAKE_GCS_DIR/<bucket>/, so their bytes do not count towards the benchmarked process's
+# memory and forked workers see each other's writes
+_store_dir = None
+
+def store_dir():
+    """Directory holding the fake objects, created on first use."""
+    global _store_dir
+    if _store_dir is None:
+        _store_dir = os.environ.get("FAKE_GCS_DIR") or tempfile.mkdtemp(prefix="fake-gcs-")
+        atexit.register(shutil.rmtree, _store_dir, True)
+    return _store_dir
+
+def object_path(bucket_name, name):
+    """Path of the file that holds gs://bucket_name/name."""
+    return os.path.join(store_dir(), bucket_name, urllib.parse.quote(name, safe=""))
+
+def object_names(bucket_name, prefix=""):
+    """Sorted names of the objects in bucket_name that start with prefix."""
+    try:
+        names = [urllib.parse.unquote(entry) for entry in os.listdir(os.path.join(store_dir(), bucket_name))
+                 if not entry.endswith(".tmp")]
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if name.startswith(prefix))
+
+def put_object(bucket_name, name, data):
+    """Store data as gs://bucket_name/name."""
+    with _ObjectWriter(bucket_name, name) as writer:
+        writer.write(data)
+
+class _ObjectWriter(io.BufferedWriter):
+    """Write an object to a temporary file and move it into place on close, like a finalised upload."""
+
+    def __init__(self, bucket_name, name):
+        self._path = object_path(bucket_name, name)
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        self._temp_path = f"{self._path}.{uuid.uuid4().hex}.tmp"
+        super().__init__(io.FileIO(self._temp_path, "wb"), buffer_size=1 << 20)
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            os.replace(self._temp_path, self._path)
+            count("gcs_bytes_written", os.path.getsize(self._path))
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def _path(self):
+        return object_path(self.bucket.name, self.name)
+
+    @property
+    def size(self):
+        try:
+            return os.path.getsize(self._path)
+        except FileNotFoundError:
+            return None
+
+    @property
+    def generation(self):
+        return 1 if os.path.exists(self._path) else None
+
+    def _open(self):
+        try:
+            return open(self._path, "rb")
+        except FileNotFoundError:
+            raise FileNotFoundError(f"gs://{self.bucket.name}/{self.name}")
+
+    def open(self, mode="rb", **kwargs):
+        if "w" in mode:
+            return _ObjectWriter(self.bucket.name, self.name)
+        reader = self._open()
+        count("gcs_bytes_read", self.size)
+        return reader
+
+    def upload_from_string(self, data, content_type=None, **kwargs):
+        put_object(self.bucket.name, self.name, data.encode("utf-8") if isinstance(data, str) else data)
+
+    def download_as_bytes(self, start=None, end=None, **kwargs):
+        with self._open() as reader:
+            reader.seek(start or 0)
+            data = reader.read() if end is None else reader.read(end + 1 - (start or 0))
+        count("gcs_bytes_read", len(data))
+        return data
+
+    download_as_string = download_as_bytes
+
+    def download_as_text(self, **kwargs):
+        return self.download_as_bytes(**kwargs).decode("utf-8")
+
+    def exists(self, **kwargs):
+        return os.path.exists(self._path)
+
+    def reload(self, **kwargs):
+        self._open().close()
+
+    def delete(self, **kwargs):
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
+
+    def compose(self, sources, **kwargs):
+        with _ObjectWriter(self.bucket.name, self.name) as writer:
+            for source in sources:
+                with source._open() as reader:
+                    shutil.copyfileobj(reader, writer)
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def blob(self, name, **kwargs):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name, **kwargs):
+        blob = FakeBlob(self, name)
+        return blob if blob.exists() else None
+
+    def list_blobs(self, prefix=None, **kwargs):
+        return self.client.list_blobs(self, prefix=prefix)
+
+class FakeStorageClient:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def bucket(self, name):
+        return FakeBucket(self, name)
+
+    def list_blobs(self, bucket_or_name, prefix=None, **kwargs):
+        bucket = bucket_or_name if isinstance(bucket_or_name, FakeBucket) else FakeBucket(self, bucket_or_name)
+        return [FakeBlob(bucket, name) for name in object_names(bucket.name, prefix or "")]
+
+# Tables written through FakeBigQueryClient: {table_ref: row count} and {table_ref: last modified}
+TABLES = {}
+MODIFIED = {}
+
+def write_table(table_ref, rows, append=False):
+    """Record a write of rows to table_ref, as a load job or to_gbq would make it."""
+    TABLES[table_ref] = (TABLES.get(table_ref, 0) if append else 0) + rows
+    MODIFIED[table_ref] = datetime.datetime.now(datetime.timezone.utc)
+    count("bq_rows_loaded", rows)
+
+class _FakeJob:
+    def __init__(self, output_rows=0):
+        self.job_id = "fake-job"
+        self.output_rows = output_rows
+        self.num_dml_affected_rows = 0
+
+    def result(self, *args, **kwargs):
+        return []
+
+class _FakeTable:
+    def __init__(self, num_rows, modified=None):
+        self.num_rows = num_rows
+        self.modified = modified
+
+class FakeBigQueryClient:
+    """Counts the rows a load job would write by reading the staged GCS objects."""
+
+    def __init__(self, *args, **kwargs):
+        self.project = kwargs.get("project")
+
+    def load_table_from_uri(self, source_uris, destination, job_config=None, **kwargs):
+        uris = [source_uris] if isinstance(source_uris, str) else list(source_uris)
+        rows = 0
+        for uri in uris:
+            bucket_name, name = uri[len("gs://"):].split("/", 1)
+            path = object_path(bucket_name, name)
+            count("gcs_bytes_read", os.path.getsize(path))
+            if name.endswith(".parquet"):
+                import pyarrow.parquet as pq
+                rows += pq.read_metadata(path).num_rows
+            else:
+                with open(path, "rb") as reader:
+                    rows += sum(chunk.count(b"\n") for chunk in iter(lambda: reader.read(1 << 20), b""))
+        table_ref = str(destination).split("$")[0]
+        append = job_config is not None and job_config.write_disposition == "WRITE_APPEND"
+        write_table(table_ref, rows, append)
+        return _FakeJob(rows)
+
+    def query(self, query, job_config=None, **kwargs):
+        return _FakeJob()
+
+    def get_table(self, table_ref):
+        return _FakeTable(TABLES.get(str(table_ref), 0), MODIFIED.get(str(table_ref)))
+
+    def delete_table(self, table_ref, not_found_ok=False, **kwargs):
+        TABLES.pop(str(table_ref), None)
+        MODIFIED.pop(str(table_ref), None)
@@ -0,0 +1,242 @@
+"""Offline throughput benchmarks for the extract and load functions.
+
+Each benchmark runs in a fresh process against local stand-ins (see
+fakes.py) for the Coursera GraphQL endpoint, Cloud Storage and BigQuery, and
+reports wall time, rows/sec, peak RSS growth and bytes moved. Requires the
+packages from both services' requirements.txt.
+
+    python benchmarks/run_benchmarks.py --sizes 1000,100000 --scenarios fetch,enrich,clean,load,flow
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import textwrap
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes  # noqa: E402
+
+SCENARIOS = ["fetch", "enrich", "clean", "load", "flow"]
+BUCKET = "zambara"
+DATASET_ID = "ETL_pipeline_kere"
+TABLE_ID = "coursera_courses"
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    # Registered like functions_framework does, so process-pool workers can unpickle its functions
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def load_services():
+    """Import both services with Storage and BigQuery clients replaced by the fakes."""
+    from google.cloud import bigquery, storage
+    storage.Client = fakes.FakeStorageClient
+    bigquery.Client = fakes.FakeBigQueryClient
+    extract = load_module("extract_main", os.path.join(ROOT, "extract_function", "main.py"))
+    load = load_module("load_main", os.path.join(ROOT, "load_function", "main.py"))
+
+    def build_dataframe(rows, table_ref):
+        # to_gbq needs a live project; measure the DataFrame build and count the rows instead
+        import pandas as pd
+        df = pd.DataFrame(rows)
+        fakes.write_table(table_ref, len(df))
+
+    load.load_dataframe = build_dataframe
+    return extract, load
+
+class Measure:
+    """Wall time and peak RSS growth of the code run inside it.
+
+    Peak RSS is the kernel's high-water mark, reset on entry through
+    /proc/self/clear_refs, less the RSS on entry, so memory used to set the
+    benchmark up is not counted. Where the mark cannot be reset the
+    process-lifetime ru_maxrss is used instead.
+    """
+
+    def __enter__(self):
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+            self.rss_before = proc_status_kb("VmRSS")
+        except OSError:
+            self.rss_before = None
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+        if self.rss_before is None:
+            self.peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        else:
+            self.peak_rss_kb = max(proc_status_kb("VmHWM") - self.rss_before, 0)
+
+def proc_status_kb(field):
+    """Read a kB field such as VmRSS from /proc/self/status."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise OSError(f"{field} not in /proc/self/status")
+
+def put_snapshot(size, seed, output_format):
+    """Stream size synthetic entities into an extract snapshot in the fake bucket and return its gs:// URI."""
+    if output_format == "ndjson":
+        name = "zambara/kere/coursera_courses_20250101_000000.ndjson"
+    else:
+        name = "zambara/kere/coursera_courses_20250101_000000.json"
+    with fakes.FakeBlob(fakes.FakeBucket(None, BUCKET), name).open("wb") as writer:
+        for i, entity in enumerate(fakes.iter_entities(size, seed)):
+            if output_format == "ndjson":
+                writer.write(json.dumps(entity, separators=(",", ":")).encode("utf-8") + b"\n")
+            else:
+                # Same layout as json.dumps(entities, indent=4), one element at a time
+                element = textwrap.indent(json.dumps(entity, indent=4), "    ")
+                writer.write(((",\n" if i else "[\n") + element).encode("utf-8"))
+        if output_format != "ndjson":
+            writer.write(b"\n]" if size else b"[]")
+    return f"gs://{BUCKET}/{name}"
+
+def run_fetch(extract, load, size, options):
+    entities = fakes.make_entities(size, seed=options["seed"])
+    with fakes.FakeGraphQLServer({None: fakes.make_response(entities)}) as server:
+        del entities
+        extract.ENDPOINT = server.url
+        with Measure() as measured:
+            fetched = extract.fetch_graphql_data(["bench"], [])
+        return measured, len(fetched)
+
+def run_enrich(extract, load, size, options):
+    entities = fakes.make_entities(size, seed=options["seed"])
+    # A cold detail cache: every id is fetched in aliased batches
+    with fakes.FakeGraphQLServer({}) as server:
+        extract.DETAIL_ENDPOINT = server.url
+        bucket = extract.get_storage_client().bucket(BUCKET)
+        with Measure() as measured:
+            enriched = sum(1 for entity in extract.enrich_entities(entities, bucket) if "details" in entity)
+        return measured, enriched
+
+def run_clean(extract, load, size, options):
+    entities = fakes.make_entities(size, seed=options["seed"])
+    if options["clean_engine"] == "arrow":
+        content = b"".join(json.dumps(e).encode("utf-8") + b"\n" for e in entities)
+        del entities
+        with Measure() as measured:
+            cleaned, _ = load.clean_data_arrow(load.parse_entities_arrow(content, "bench.ndjson"))
+    else:
+        with Measure() as measured:
+            cleaned = load.clean_data(entities)
+    return measured, len(cleaned)
+
+def run_load(extract, load, size, options):
+    gcs_uri = put_snapshot(size, options["seed"], options["format"])
+    fakes.reset_counters()
+    with Measure() as measured:
+        result = load.load_to_bigquery(gcs_uri, DATASET_ID, TABLE_ID, "WRITE_TRUNCATE",
+                                       options["load_mode"], options["clean_engine"],
+                                       streaming=options["streaming"])
+    if isinstance(result, tuple):
+        raise RuntimeError(result[0])
+    return measured, result
+
+def run_flow(extract, load, size, options):
+    import flask
+    app = flask.Flask("benchmark")
+    extract_request = {
+        "handoff": "queue",
+        "use_cache": False,
+        "output_format": options["format"],
+        "load_mode": options["load_mode"],
+        "clean_engine": options["clean_engine"],
+        "streaming": options["streaming"]
+    }
+    with fakes.FakeGraphQLServer({None: fakes.make_response(fakes.make_entities(size, seed=options["seed"]))}) as server:
+        extract.ENDPOINT = server.url
+        with Measure() as measured:
+            with app.test_request_context(json=extract_request):
+                body, status = extract.extract_to_gcs(flask.request)
+            if status != 200:
+                raise RuntimeError(body)
+            with app.test_request_context(json={"drain": True}):
+                body, status = load.gcs_to_bigquery(flask.request)
+    if status != 200:
+        raise RuntimeError(body)
+    return measured, sum(result.get("rows_loaded", 0) for result in json.loads(body)["loads"])
+
+RUNNERS = {"fetch": run_fetch, "enrich": run_enrich, "clean": run_clean, "load": run_load, "flow": run_flow}
+
+def run_child(scenario, size, options, results):
+    """Run one benchmark in this (fresh) process and put its measurements on results."""
+    os.environ["JOB_QUEUE_DIR"] = tempfile.mkdtemp(prefix="bench-queue-")
+    import logging
+    extract, load = load_services()
+    # Keep the services' logging and metrics output cost in the measurement but not on the console
+    devnull = open(os.devnull, "w")
+    for handler in logging.getLogger().handlers:
+        handler.setStream(devnull)
+    sys.stdout = devnull
+    fakes.reset_counters()
+    try:
+        measured, rows = RUNNERS[scenario](extract, load, size, options)
+    except Exception as e:
+        results.put({"scenario": scenario, "size": size, "error": str(e)})
+        return
+    results.put({
+        "scenario": scenario,
+        "size": size,
+        "seconds": round(measured.seconds, 4),
+        "rows": rows,
+        "rows_per_sec": round(rows / measured.seconds) if measured.seconds else None,
+        "peak_rss_growth_mb": round(measured.peak_rss_kb / 1024, 1),
+        "bytes_moved": sum(v for k, v in fakes.COUNTERS.items() if k.endswith("bytes_written")
+                           or k.endswith("bytes_read") or k.endswith("bytes_served"))
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="comma-separated entity counts (1k to 10M)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="comma-separated subset of %s" % ",".join(SCENARIOS))
+    parser.add_argument("--format", choices=["json", "ndjson"], default="json", help="snapshot format")
+    parser.add_argument("--load-mode", choices=["pandas", "native", "model"], default="pandas")
+    parser.add_argument("--clean-engine", choices=["python", "arrow"], default="python")
+    parser.add_argument("--streaming", action="store_true", default=None,
+                        help="force the streaming ingest path (default: by snapshot size)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    args = parser.parse_args()
+    options = {"format": args.format, "load_mode": args.load_mode,
+               "clean_engine": args.clean_engine, "streaming": args.streaming, "seed": args.seed}
+
+    context = multiprocessing.get_context("spawn")
+    all_results = []
+    print("%-8s %10s %10s %12s %12s %14s" % ("scenario", "entities", "seconds", "rows/sec", "peak RSS +MB", "bytes moved"))
+    for size in [int(s) for s in args.sizes.split(",")]:
+        for scenario in args.scenarios.split(","):
+            results = context.Queue()
+            process = context.Process(target=run_child, args=(scenario, size, options, results))
+            process.start()
+            result = results.get()
+            process.join()
+            all_results.append(result)
+            if "error" in result:
+                print("%-8s %10d  failed: %s" % (scenario, size, result["error"]))
+            else:
+                print("%-8s %10d %10.3f %12s %12.1f %14d" % (
+                    scenario, size, result["seconds"], result["rows_per_sec"],
+                    result["peak_rss_growth_mb"], result["bytes_moved"]))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"options": options, "results": all_results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
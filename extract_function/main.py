@@ -4,6 +4,25 @@ import json
 from google.cloud import storage
 import logging
 import datetime
+import gzip
+import hashlib
+import itertools
+import os
+import random
+import time
+import threading
+import uuid
+import contextlib
+import contextvars
+import functools
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from google.api_core import exceptions as gcs_exceptions
+import google.auth.jwt
+import google.auth.transport.requests
+import google.oauth2.id_token
 
 logging.basicConfig(level=logging.INFO)
 
@@ -24,78 +43,1157 @@ PAYLOAD = {
     "query": "query DiscoveryCollections($contextType: String!, $contextId: String!, $passThroughParameters: [DiscoveryCollections_PassThroughParameter!]) { DiscoveryCollections { queryCollections(input: {contextType: $contextType, contextId: $contextId, passThroughParameters: $passThroughParameters}) { ...DiscoveryCollections_DiscoveryCollection __typename } __typename } } fragment DiscoveryCollections_DiscoveryCollection on DiscoveryCollections_productCollection { __typename id label linkedCollectionPageMetadata { url __typename } entities { ...DiscoveryCollections_DiscoveryEntity __typename } } fragment DiscoveryCollections_DiscoveryEntity on DiscoveryCollections_learningProduct { __typename id slug name url partnerIds imageUrl partners { ...DiscoveryCollections_DiscoveryCollectionsPartner __typename } ... on DiscoveryCollections_specialization { courseCount difficultyLevel isPartOfCourseraPlus productCard { ...DiscoveryCollections_ProductCard __typename } } ... on DiscoveryCollections_professionalCertificate { difficultyLevel isPartOfCourseraPlus productCard { ...DiscoveryCollections_ProductCard __typename } } } fragment DiscoveryCollections_DiscoveryCollectionsPartner on DiscoveryCollections_partner { id name logo __typename } fragment DiscoveryCollections_ProductCard on ProductCard_ProductCard { id marketingProductType productTypeAttributes { ... on ProductCard_Specialization { isPathwayContent __typename } __typename } __typename }"
 }
 
-def fetch_graphql_data():
+# Contexts and search queries swept on every run. Each (context, query) pair is
+# one DiscoveryCollections call; a query of None means the plain zero-state page.
+CONTEXT_IDS = [c for c in os.environ.get("CONTEXT_IDS", "search-zero-state").split(",") if c]
+SEARCH_QUERIES = [q for q in os.environ.get("SEARCH_QUERIES", "").split(",") if q]
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "8"))
+REQUEST_TIMEOUT = float(os.environ.get("REQUEST_TIMEOUT", "30"))
+# Conditional-fetch cache of GraphQL responses, one GCS object per operation + variables
+CACHE_PREFIX = "zambara/kere/cache/"
+# Entries older than this are refetched unconditionally rather than revalidated
+CACHE_TTL_SECONDS = int(os.environ.get("CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Pending load jobs for the queued handoff; JOB_QUEUE_DIR switches to a local directory queue
+OUTBOX_PREFIX = "zambara/kere/outbox/"
+JOB_QUEUE_DIR = os.environ.get("JOB_QUEUE_DIR")
+# Fraction of GraphQL responses whose first few entities are logged, instead of whole responses
+PAYLOAD_LOG_SAMPLE_RATE = float(os.environ.get("PAYLOAD_LOG_SAMPLE_RATE", "0"))
+PAYLOAD_LOG_MAX_CHARS = 2000
+# Resumable upload chunk size for streamed NDJSON output (must be a multiple of 256 KiB)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# Paginated sweeps write one part object per page and checkpoint their progress after every page
+CHECKPOINT_PREFIX = "zambara/kere/checkpoints/"
+PARTS_PREFIX = "zambara/kere/parts/"
+# passThroughParameter carrying the page number; page 1 is requested without it
+PAGE_PARAMETER = os.environ.get("PAGE_PARAMETER", "page")
+MAX_PAGES = int(os.environ.get("MAX_PAGES", "50"))
+# No new page is started after this many seconds, so the checkpoint is saved before the request times out
+EXTRACT_TIME_BUDGET_SECONDS = float(os.environ.get("EXTRACT_TIME_BUDGET_SECONDS", "240"))
+# Checkpoints older than this are discarded instead of resumed
+CHECKPOINT_TTL_SECONDS = int(os.environ.get("CHECKPOINT_TTL_SECONDS", str(24 * 3600)))
+# A sweep whose page fails (other than 429) in this many invocations in a row is given up
+PAGE_MAX_FAILURES = 3
+# GCS compose accepts at most 32 source objects per call
+COMPOSE_MAX_SOURCES = 32
+
+# Per-course detail enrichment. The gateway's detail operation is not part of the public site's
+# search payload, so its root field and selection are configurable; one aliased field is sent per id
+DETAIL_ENDPOINT = "https://www.coursera.org/graphql-gateway?opname=CourseDetails"
+DETAIL_ROOT_FIELD = os.environ.get("DETAIL_ROOT_FIELD", "ProductDetails_get")
+DETAIL_FIELDS = os.environ.get("DETAIL_FIELDS", "id description averageRating enrollmentCount skills")
+DETAIL_BATCH_SIZE = int(os.environ.get("DETAIL_BATCH_SIZE", "50"))
+# Upper bound of the adaptive concurrency limit for detail batches
+DETAIL_MAX_CONCURRENCY = int(os.environ.get("DETAIL_MAX_CONCURRENCY", str(MAX_WORKERS)))
+# Entities are enriched this many at a time so streamed output keeps flowing
+ENRICH_CHUNK_SIZE = 5000
+# Per-id detail cache, spread over a fixed number of shard objects
+DETAIL_CACHE_PREFIX = "zambara/kere/details/"
+DETAIL_CACHE_SHARDS = 64
+DETAIL_TTL_SECONDS = int(os.environ.get("DETAIL_TTL_SECONDS", str(3 * 24 * 3600)))
+LOAD_FUNCTION_URL = os.environ.get("LOAD_FUNCTION_URL", "https://etl-kere-load-82546987242.us-central1.run.app")
+# Entities per request when pushing rows to the load function's Storage Write API sink
+PUSH_BATCH_SIZE = int(os.environ.get("PUSH_BATCH_SIZE", "1000"))
+
+# Retry policy of the shared HTTP session. GraphQL reads are safe to retry; the synchronous
+# load trigger is not (a 504 can mean the load ran past its timeout), so it gets its own session
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "3"))
+HTTP_BACKOFF_FACTOR = float(os.environ.get("HTTP_BACKOFF_FACTOR", "0.5"))
+# Seconds to wait for the synchronous load trigger, which runs the whole load
+LOAD_TRIGGER_TIMEOUT = int(os.environ.get("LOAD_TRIGGER_TIMEOUT", "540"))
+
+SERVICE_NAME = "extract_function"
+
+# Optional export of run metrics: "prometheus" pushes them to PROMETHEUS_PUSHGATEWAY_URL,
+# "otel" records spans and counters through the OpenTelemetry API
+METRICS_EXPORTER = os.environ.get("METRICS_EXPORTER", "")
+PROMETHEUS_PUSHGATEWAY_URL = os.environ.get("PROMETHEUS_PUSHGATEWAY_URL", "")
+
+class RunMetrics:
+    """Timed spans and counters for one invocation, emitted as a single structured record."""
+
+    def __init__(self, service):
+        self.service = service
+        self.run_id = uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._tracer = otel_tracer() if METRICS_EXPORTER == "otel" else None
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """Time a stage. Repeated or concurrent spans with the same name accumulate."""
+        otel_span = self._tracer.start_as_current_span(name) if self._tracer else contextlib.nullcontext()
+        start = time.perf_counter()
+        try:
+            with otel_span:
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.spans[name] = self.spans.get(name, 0.0) + elapsed
+
+    def incr(self, name, value=1):
+        """Add value to a counter."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """Return the spans (in seconds) and counters recorded so far."""
+        with self._lock:
+            return {
+                "service": self.service,
+                "run_id": self.run_id,
+                "total_seconds": round(time.perf_counter() - self.started, 4),
+                "spans": {name: round(seconds, 4) for name, seconds in self.spans.items()},
+                "counters": dict(self.counters)
+            }
+
+    def emit(self):
+        """Write the summary as one structured log line and hand it to the configured exporter."""
+        summary = self.summary()
+        # A JSON line on stdout becomes a structured entry in Cloud Logging
+        print(json.dumps(dict(summary, severity="INFO", message="run metrics")), flush=True)
+        try:
+            if METRICS_EXPORTER == "prometheus" and PROMETHEUS_PUSHGATEWAY_URL:
+                push_prometheus(summary)
+            elif METRICS_EXPORTER == "otel":
+                record_otel_counters(summary)
+        except Exception as e:
+            logging.warning("Failed to export run metrics: %s", str(e))
+        return summary
+
+_current_metrics = contextvars.ContextVar("run_metrics", default=None)
+
+def current_metrics():
+    """Return the metrics of the running invocation, or a detached instance outside one."""
+    metrics = _current_metrics.get()
+    return metrics if metrics is not None else RunMetrics(SERVICE_NAME)
+
+def instrumented(handler):
+    """Run an HTTP handler under a fresh RunMetrics and attach the summary to its JSON response."""
+    @functools.wraps(handler)
+    def wrapper(request):
+        metrics = RunMetrics(SERVICE_NAME)
+        token = _current_metrics.set(metrics)
+        try:
+            body, status = handler(request)
+        finally:
+            _current_metrics.reset(token)
+            summary = metrics.emit()
+        try:
+            body = json.dumps(dict(json.loads(body), metrics=summary))
+        except (TypeError, ValueError):
+            pass
+        return body, status
+    return wrapper
+
+def prometheus_text(summary):
+    """Render a run summary in the Prometheus text exposition format."""
+    labels = f'service="{summary["service"]}"'
+    lines = ["# TYPE etl_stage_seconds gauge"]
+    lines += [f'etl_stage_seconds{{{labels},stage="{name}"}} {seconds}' for name, seconds in summary["spans"].items()]
+    lines += [f"etl_run_seconds{{{labels}}} {summary['total_seconds']}"]
+    lines += [f"etl_{name}{{{labels}}} {value}" for name, value in summary["counters"].items()]
+    return "\n".join(lines) + "\n"
+
+def push_prometheus(summary):
+    """Push a run summary to a Prometheus Pushgateway."""
+    url = f"{PROMETHEUS_PUSHGATEWAY_URL.rstrip('/')}/metrics/job/{summary['service']}"
+    request = urllib.request.Request(url, data=prometheus_text(summary).encode("utf-8"), method="PUT",
+                                     headers={"Content-Type": "text/plain; version=0.0.4"})
+    urllib.request.urlopen(request, timeout=5).close()
+
+def otel_tracer():
+    """Return an OpenTelemetry tracer, or None when the API is not installed."""
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        logging.warning("METRICS_EXPORTER=otel but opentelemetry-api is not installed")
+        return None
+    return trace.get_tracer(SERVICE_NAME)
+
+_otel_counters = {}
+
+def record_otel_counters(summary):
+    """Add a run's counters to OpenTelemetry counters of the same name."""
+    from opentelemetry import metrics
+    meter = metrics.get_meter(SERVICE_NAME)
+    for name, value in summary["counters"].items():
+        if name not in _otel_counters:
+            _otel_counters[name] = meter.create_counter(f"etl.{name}")
+        _otel_counters[name].add(value, {"service": summary["service"]})
+
+# Clients shared across invocations of a warm container, built on first use
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _get_client(name, factory):
+    """Return the shared client registered under name, building it on first use."""
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = factory()
+        return _clients[name]
+
+def _build_session():
+    """Build a keep-alive session with a connection pool sized for the worker pool and retry/backoff."""
+    retry = Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "POST"]),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_session():
+    """Return the shared keep-alive HTTP session."""
+    return _get_client("http", _build_session)
+
+def _build_trigger_session():
+    """Build a keep-alive session that never retries, for requests that must not run twice."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_trigger_session():
+    """Return the shared HTTP session for the synchronous load trigger."""
+    return _get_client("http_trigger", _build_trigger_session)
+
+def get_storage_client():
+    """Return the shared Cloud Storage client."""
+    return _get_client("storage", storage.Client)
+
+def warm_clients():
+    """Build the shared clients at container start so the first request does not pay for it."""
+    try:
+        get_session()
+        get_storage_client()
+    except Exception as e:
+        logging.warning("Failed to warm clients, they will be built on first use: %s", str(e))
+
+warm_clients()
+
+def build_payload(context_id, query=None, page=None):
+    """Build a DiscoveryCollections payload for one context, optional search query and page."""
+    variables = {"contextType": "PAGE", "contextId": context_id}
+    parameters = []
+    if query:
+        parameters.append({"name": "query", "value": query})
+    if page and page > 1:
+        parameters.append({"name": PAGE_PARAMETER, "value": str(page)})
+    if parameters:
+        variables["passThroughParameters"] = parameters
+    return dict(PAYLOAD, variables=variables)
+
+def cache_key(payload, enrich=False):
+    """Cache key for a GraphQL call: its operation name and canonicalised variables.
+
+    Enriched runs keep their own entries, so a plain run never makes an enriched one look unchanged.
+    """
+    key = payload["operationName"] + json.dumps(payload["variables"], sort_keys=True)
+    key += ":enriched" if enrich else ""
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def read_cache_entry(bucket, key):
+    """Return the cached response entry for key, or None if absent or unreadable."""
+    blob = bucket.blob(f"{CACHE_PREFIX}{key}.json.gz")
+    try:
+        return json.loads(gzip.decompress(blob.download_as_bytes()))
+    except Exception:
+        return None
+
+def write_cache_entry(bucket, key, entry):
+    """Store a response entry (digest, validators and entities) as gzip-compressed JSON."""
+    content = gzip.compress(json.dumps(entry, separators=(",", ":")).encode("utf-8"))
+    bucket.blob(f"{CACHE_PREFIX}{key}.json.gz").upload_from_string(content, content_type="application/gzip")
+
+def delete_cache_entry(bucket, key):
+    """Drop the cached response entry for key so the next run counts the call as changed."""
     try:
-        logging.info("Sending request to Coursera GraphQL endpoint")
-        response = requests.post(ENDPOINT, headers=HEADERS, json=PAYLOAD)
+        bucket.blob(f"{CACHE_PREFIX}{key}.json.gz").delete()
+    except gcs_exceptions.NotFound:
+        pass
+    except Exception as e:
+        logging.warning("Failed to drop response cache entry %s: %s", key, str(e))
+
+def fetch_collections(payload, cache_bucket=None, enrich=False):
+    """Run one DiscoveryCollections call and return (entities of every collection, changed, cache update).
+
+    With a cache bucket the request is revalidated with ETag/Last-Modified when
+    the cached entry is within its TTL, and changed is False when the server
+    answers 304 or the entities digest matches the cached one. The cache update
+    is a (key, entry) pair for commit_cache_entries, or None. enrich selects
+    the entries of enriched runs.
+    """
+    key = cache_key(payload, enrich)
+    entry = read_cache_entry(cache_bucket, key) if cache_bucket is not None else None
+    headers = {}
+    if entry and time.time() - entry["fetched_at"] < CACHE_TTL_SECONDS:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    metrics = current_metrics()
+    metrics.incr("graphql_calls")
+    with metrics.span("fetch"):
+        response = get_session().post(ENDPOINT, json=payload, headers=dict(HEADERS, **headers), timeout=REQUEST_TIMEOUT)
+        retries = getattr(response.raw, "retries", None)
+        if retries and retries.history:
+            metrics.incr("retries", len(retries.history))
+        metrics.incr("bytes_fetched", len(response.content))
+        if response.status_code == 304 and headers:
+            metrics.incr("cache_hits")
+            return entry["entities"], False, None
         response.raise_for_status()
         data = response.json()
-        logging.info("Response received: %s", json.dumps(data, indent=2))
-        if "errors" in data:
-            logging.error("GraphQL errors: %s", json.dumps(data["errors"]))
-            return None
-        if not data.get("data") or not data["data"].get("DiscoveryCollections"):
-            logging.error("Unexpected response structure: %s", json.dumps(data))
-            return None
-        return data["data"]["DiscoveryCollections"]["queryCollections"][0]["entities"]
-    except requests.exceptions.RequestException as e:
+    if "errors" in data:
+        raise ValueError("GraphQL errors: %s" % json.dumps(data["errors"]))
+    if not data.get("data") or not data["data"].get("DiscoveryCollections"):
+        raise ValueError("Unexpected response structure: %s" % json.dumps(data)[:1000])
+    collections = data["data"]["DiscoveryCollections"]["queryCollections"] or []
+    entities = [entity for collection in collections for entity in (collection.get("entities") or [])]
+    metrics.incr("entities_fetched", len(entities))
+    if PAYLOAD_LOG_SAMPLE_RATE and random.random() < PAYLOAD_LOG_SAMPLE_RATE:
+        logging.info("Sampled response for %s: %d entities, first: %s", payload["variables"], len(entities),
+                     json.dumps(entities[:3])[:PAYLOAD_LOG_MAX_CHARS])
+    if cache_bucket is None:
+        return entities, True, None
+
+    digest = hashlib.sha256(json.dumps(entities, sort_keys=True).encode("utf-8")).hexdigest()
+    changed = not entry or entry["digest"] != digest
+    if not changed:
+        metrics.incr("cache_hits")
+    return entities, changed, (key, {
+        "digest": digest,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "fetched_at": time.time(),
+        "entities": entities
+    })
+
+class AdaptiveRateLimiter:
+    """AIMD limit on concurrent upstream calls.
+
+    The limit grows by one for every limit successful calls (additive
+    increase) and halves, down to one, whenever the upstream throttles
+    (multiplicative decrease). A Retry-After from a throttled call holds
+    back new calls until it has passed.
+    """
+
+    def __init__(self, initial=2, maximum=DETAIL_MAX_CONCURRENCY):
+        self.limit = float(min(initial, maximum))
+        self.maximum = maximum
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Hold one of the currently allowed concurrent calls."""
+        with self._condition:
+            while self.in_flight >= int(self.limit) or time.monotonic() < self.paused_until:
+                self._condition.wait(timeout=max(self.paused_until - time.monotonic(), 0.05))
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def success(self):
+        with self._condition:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+    def throttled(self, retry_after=None):
+        with self._condition:
+            self.limit = max(1.0, self.limit / 2)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        current_metrics().incr("throttled")
+
+def build_detail_payload(ids):
+    """Build one aliased GraphQL query that fetches the details of every id in ids."""
+    declarations = ", ".join(f"$id{i}: String!" for i in range(len(ids)))
+    fields = " ".join(f"d{i}: {DETAIL_ROOT_FIELD}(id: $id{i}) {{ {DETAIL_FIELDS} }}" for i in range(len(ids)))
+    return {
+        "operationName": "CourseDetails",
+        "variables": {f"id{i}": entity_id for i, entity_id in enumerate(ids)},
+        "query": f"query CourseDetails({declarations}) {{ {fields} }}"
+    }
+
+def fetch_detail_batch(ids, limiter):
+    """Fetch the details of a batch of ids in one request. Returns {id: details} for the ids found."""
+    metrics = current_metrics()
+    metrics.incr("detail_calls")
+    with limiter.slot(), metrics.span("enrich_fetch"):
+        response = get_session().post(DETAIL_ENDPOINT, json=build_detail_payload(ids), headers=HEADERS,
+                                      timeout=REQUEST_TIMEOUT)
+    # Throttling the session's retries absorbed still counts as congestion
+    retries = getattr(response.raw, "retries", None)
+    history = retries.history if retries else ()
+    if response.status_code in (429, 503) or any(attempt.status in (429, 503) for attempt in history):
+        try:
+            retry_after = float(response.headers.get("Retry-After", ""))
+        except ValueError:
+            retry_after = None
+        limiter.throttled(retry_after)
+    else:
+        limiter.success()
+    response.raise_for_status()
+    body = response.json()
+    if body.get("errors"):
+        logging.warning("Detail query for %d ids returned errors: %s", len(ids),
+                        json.dumps(body["errors"])[:PAYLOAD_LOG_MAX_CHARS])
+    data = body.get("data") or {}
+    return {entity_id: data[f"d{i}"] for i, entity_id in enumerate(ids) if data.get(f"d{i}") is not None}
+
+def fetch_details(ids, limiter):
+    """Fetch details for ids in DETAIL_BATCH_SIZE batches running concurrently under limiter."""
+    if not ids:
+        return {}
+    batches = [ids[start:start + DETAIL_BATCH_SIZE] for start in range(0, len(ids), DETAIL_BATCH_SIZE)]
+    details = {}
+    with ThreadPoolExecutor(max_workers=min(DETAIL_MAX_CONCURRENCY, len(batches))) as executor:
+        futures = {executor.submit(contextvars.copy_context().run, fetch_detail_batch, batch, limiter): batch
+                   for batch in batches}
+        for future in as_completed(futures):
+            try:
+                details.update(future.result())
+            except (requests.exceptions.RequestException, ValueError) as e:
+                current_metrics().incr("detail_failures")
+                logging.error("Failed to fetch details for %d ids: %s", len(futures[future]), str(e))
+    return details
+
+def detail_shard(entity_id):
+    """Index of the detail cache shard that holds entity_id."""
+    return int(hashlib.sha256(entity_id.encode("utf-8")).hexdigest()[:8], 16) % DETAIL_CACHE_SHARDS
+
+def read_detail_cache(bucket):
+    """Read every detail cache shard concurrently. Returns {shard: {id: entry}}."""
+    def read(shard):
+        blob = bucket.blob(f"{DETAIL_CACHE_PREFIX}{shard:03d}.json.gz")
+        try:
+            return shard, json.loads(gzip.decompress(blob.download_as_bytes()))
+        except Exception:
+            return shard, {}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        return dict(executor.map(read, range(DETAIL_CACHE_SHARDS)))
+
+def write_detail_cache(bucket, cache, shards):
+    """Write back the given detail cache shards."""
+    def write(shard):
+        content = gzip.compress(json.dumps(cache[shard], separators=(",", ":")).encode("utf-8"))
+        bucket.blob(f"{DETAIL_CACHE_PREFIX}{shard:03d}.json.gz").upload_from_string(
+            content, content_type="application/gzip")
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for future in [executor.submit(write, shard) for shard in shards]:
+            try:
+                future.result()
+            except Exception as e:
+                logging.warning("Failed to update detail cache shard: %s", str(e))
+
+def details_outdated(entities, cache):
+    """Whether any entity lacks an entry younger than DETAIL_TTL_SECONDS in cache, as read by read_detail_cache."""
+    now = time.time()
+    for entity in entities:
+        entry = cache.get(detail_shard(entity["id"]), {}).get(entity["id"])
+        if not entry or now - entry["fetched_at"] >= DETAIL_TTL_SECONDS:
+            logging.info("Details of %s are missing or expired", entity["id"])
+            return True
+    return False
+
+def enrich_entities(entities, cache_bucket=None, cache=None):
+    """Attach per-course details to entities as entity["details"], yielding them as they are enriched.
+
+    Only ids without a cached entry younger than DETAIL_TTL_SECONDS are
+    fetched; when a refresh fails the stale entry is still used. Entities
+    with no details at all are yielded unchanged. The cache is written back
+    once every entity has been yielded. A cache already read with
+    read_detail_cache can be passed to save reading it again.
+    """
+    metrics = current_metrics()
+    if cache is None:
+        cache = read_detail_cache(cache_bucket) if cache_bucket is not None else {}
+    limiter = AdaptiveRateLimiter()
+    dirty = set()
+    entities = iter(entities)
+    while True:
+        chunk = list(itertools.islice(entities, ENRICH_CHUNK_SIZE))
+        if not chunk:
+            break
+        now = time.time()
+        stale = []
+        for entity in chunk:
+            entry = cache.get(detail_shard(entity["id"]), {}).get(entity["id"])
+            if entry and now - entry["fetched_at"] < DETAIL_TTL_SECONDS:
+                metrics.incr("detail_cache_hits")
+            else:
+                stale.append(entity["id"])
+        with metrics.span("enrich"):
+            fetched = fetch_details(stale, limiter)
+        metrics.incr("details_fetched", len(fetched))
+        for entity_id, details in fetched.items():
+            shard = detail_shard(entity_id)
+            cache.setdefault(shard, {})[entity_id] = {"fetched_at": now, "details": details}
+            dirty.add(shard)
+        for entity in chunk:
+            entry = cache.get(detail_shard(entity["id"]), {}).get(entity["id"])
+            yield dict(entity, details=entry["details"]) if entry else entity
+    if cache_bucket is not None and dirty:
+        write_detail_cache(cache_bucket, cache, dirty)
+
+def commit_cache_entries(bucket, state):
+    """Persist the cache updates collected in state once the run's output is safely stored.
+
+    Nothing is committed for a run with failed calls, whose output did not
+    cover every response.
+    """
+    if state.get("failed"):
+        logging.warning("Not updating the response cache after %d failed calls", len(state["failed"]))
+        return
+    for key, entry in state.get("cache_updates", []):
+        try:
+            write_cache_entry(bucket, key, entry)
+        except Exception as e:
+            logging.warning("Failed to update response cache entry %s: %s", key, str(e))
+
+def iter_graphql_entities(context_ids=None, queries=None, cache_bucket=None, state=None, enrich=False):
+    """Fan out DiscoveryCollections calls over a bounded pool and yield unique entities as they arrive.
+
+    state["changed"] is set to True before the entities of the first response
+    that differs from the cache are yielded, and state["cache_updates"] collects
+    the entries to commit once the output is stored. state["failed"] collects
+    the cache keys of failed calls, whose cached entries are dropped so the
+    next run cannot find them unchanged. Raises RuntimeError once
+    exhausted if any call failed (after the session's retries): every load
+    takes a snapshot for the whole catalogue, so one missing context would
+    delete its courses.
+    """
+    state = {} if state is None else state
+    state.setdefault("changed", False)
+    state.setdefault("cache_updates", [])
+    state.setdefault("failed", [])
+    context_ids = context_ids or CONTEXT_IDS
+    payloads = [build_payload(c, q) for c in context_ids for q in ([None] + list(queries or SEARCH_QUERIES))]
+    logging.info("Sending %d requests to Coursera GraphQL endpoint", len(payloads))
+
+    seen_ids = set()
+    failures = 0
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(payloads))) as executor:
+        # Each call runs in a copy of this context so it records into the invocation's metrics
+        futures = {executor.submit(contextvars.copy_context().run, fetch_collections, p, cache_bucket, enrich): p
+                   for p in payloads}
+        for future in as_completed(futures):
+            try:
+                entities, changed, cache_update = future.result()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                failures += 1
+                current_metrics().incr("graphql_failures")
+                logging.error("Failed to fetch Coursera data for %s: %s", futures[future]["variables"], str(e))
+                key = cache_key(futures[future], enrich)
+                state["failed"].append(key)
+                if cache_bucket is not None:
+                    delete_cache_entry(cache_bucket, key)
+                continue
+            state["changed"] = state["changed"] or changed
+            if cache_update:
+                state["cache_updates"].append(cache_update)
+            for entity in entities:
+                if entity.get("id") not in seen_ids:
+                    seen_ids.add(entity.get("id"))
+                    yield entity
+
+    if failures:
+        raise RuntimeError("%d of %d Coursera GraphQL calls failed" % (failures, len(payloads)))
+    logging.info("Fetched %d unique entities from %d calls", len(seen_ids), len(payloads))
+
+def fetch_graphql_data(context_ids=None, queries=None, cache_bucket=None, state=None, enrich=False):
+    """Fetch and merge entities from every configured context and query."""
+    try:
+        return list(iter_graphql_entities(context_ids, queries, cache_bucket, state, enrich))
+    except RuntimeError as e:
         logging.error("Failed to fetch Coursera data: %s", str(e))
         return None
 
+def wait_for_change(entities, state, outdated=None):
+    """Consume entities until one comes from a changed response.
+
+    Returns an iterator over every entity (buffered ones first), or None if the
+    stream ended without any response differing from the cache. When it ends
+    unchanged, outdated is called with the buffered entities and a true result
+    counts as a change.
+    """
+    buffered = []
+    for entity in entities:
+        buffered.append(entity)
+        if state["changed"]:
+            return itertools.chain(buffered, entities)
+    if not state["changed"] and outdated is not None and outdated(buffered):
+        state["changed"] = True
+    return iter(buffered) if state["changed"] else None
+
+def write_ndjson(blob, entities, compress=False):
+    """Stream entities into a resumable GCS upload as compact newline-delimited JSON.
+
+    Returns the number of records written. The object is only kept if every
+    record was written; on failure the partial upload is deleted.
+    """
+    writer = blob.open("wb", chunk_size=UPLOAD_CHUNK_SIZE,
+                       content_type="application/gzip" if compress else "application/x-ndjson")
+    stream = gzip.GzipFile(fileobj=writer, mode="wb") if compress else writer
+    count = 0
+    size = 0
+    try:
+        for entity in entities:
+            line = json.dumps(entity, separators=(",", ":")).encode("utf-8") + b"\n"
+            stream.write(line)
+            count += 1
+            size += len(line)
+    except BaseException:
+        # Closing a BlobWriter always finalises the object, so drop it afterwards
+        writer.close()
+        blob.delete()
+        raise
+    if compress:
+        stream.close()
+    writer.close()
+    current_metrics().incr("rows_written", count)
+    current_metrics().incr("bytes_serialised", size)
+    return count
+
+def push_entities(entities, stream_type="pending"):
+    """Send entities to the load function's push mode in batches over one write stream.
+
+    A first request without rows opens the stream. Every request with rows
+    then carries that stream and the offset returned by the previous one, so
+    BigQuery drops rows a retried request already appended. A final request
+    commits the stream; with a pending stream no row is visible before it.
+    Returns (entities pushed, final push response).
+    """
+    entities = iter(entities)
+    push = {"stream_type": stream_type, "stream": None, "offset": 0}
+    response = get_session().post(
+        LOAD_FUNCTION_URL,
+        headers={"Authorization": f"Bearer {get_id_token()}"},
+        json={"push": dict(push, entities=[], commit=False)},
+        timeout=REQUEST_TIMEOUT
+    )
+    response.raise_for_status()
+    push["stream"] = response.json()["stream"]
+    pushed = 0
+    while True:
+        batch = list(itertools.islice(entities, PUSH_BATCH_SIZE))
+        response = get_session().post(
+            LOAD_FUNCTION_URL,
+            headers={"Authorization": f"Bearer {get_id_token()}"},
+            json={"push": dict(push, entities=batch, commit=not batch)},
+            timeout=REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        result = response.json()
+        if not batch:
+            return pushed, result
+        pushed += len(batch)
+        push["stream"] = result["stream"]
+        push["offset"] = result["next_offset"]
+
+def compose_parts(bucket, part_names, destination_path, content_type, intermediate_prefix):
+    """Concatenate part objects into destination_path with GCS compose.
+
+    Parts are composed COMPOSE_MAX_SOURCES at a time into intermediate
+    objects under intermediate_prefix until one call can produce the
+    destination. Intermediates must stay out of the snapshot prefix, where
+    the load function would take them for snapshots. NDJSON and gzip
+    members both stay valid when concatenated.
+    """
+    names = list(part_names)
+    intermediates = []
+    level = 0
+    try:
+        while len(names) > COMPOSE_MAX_SOURCES:
+            composed = []
+            for start in range(0, len(names), COMPOSE_MAX_SOURCES):
+                target = bucket.blob(f"{intermediate_prefix}compose{level}_{start // COMPOSE_MAX_SOURCES:05d}")
+                target.content_type = content_type
+                target.compose([bucket.blob(name) for name in names[start:start + COMPOSE_MAX_SOURCES]])
+                composed.append(target.name)
+            intermediates.extend(composed)
+            names = composed
+            level += 1
+        target = bucket.blob(destination_path)
+        target.content_type = content_type
+        target.compose([bucket.blob(name) for name in names])
+    finally:
+        for name in intermediates:
+            try:
+                bucket.blob(name).delete()
+            except gcs_exceptions.NotFound:
+                pass
+    current_metrics().incr("parts_composed", len(part_names))
+
+class ExtractCheckpoint:
+    """Progress of a paginated extract, stored as one GCS object and saved after every page.
+
+    The state records, for every (context, query) sweep, the next page to
+    fetch and whether it is done, plus the part objects written so far, the
+    entity ids already written and the final destination. Saves use GCS
+    generation preconditions, so two invocations can never both advance the
+    same checkpoint.
+    """
+
+    def __init__(self, bucket, key, state, generation=None):
+        self.bucket = bucket
+        self.key = key
+        self.state = state
+        self.generation = generation
+        self.seen_ids = set(state.pop("seen_ids", []))
+        # Ids of pages whose part is still being written, claimed so concurrent sweeps skip them
+        self.claimed_ids = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(context_ids, queries, compress):
+        """Checkpoint key of a sweep: re-invoking with the same inputs resumes the same checkpoint."""
+        key = json.dumps({"context_ids": context_ids, "queries": queries, "compress": compress}, sort_keys=True)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def load(cls, bucket, key):
+        """Return the saved checkpoint for key, or None if there is none or it has expired."""
+        blob = bucket.get_blob(f"{CHECKPOINT_PREFIX}{key}.json.gz")
+        if blob is None:
+            return None
+        checkpoint = cls(bucket, key, json.loads(gzip.decompress(blob.download_as_bytes())), blob.generation)
+        if time.time() - checkpoint.state["created_at"] > CHECKPOINT_TTL_SECONDS:
+            logging.warning("Discarding expired extract checkpoint %s", key)
+            checkpoint.delete()
+            return None
+        return checkpoint
+
+    @classmethod
+    def start(cls, bucket, key, context_ids, queries, destination_path, compress):
+        """Create and save a checkpoint for a new sweep over every (context, query) pair."""
+        state = {
+            "created_at": time.time(),
+            "destination_path": destination_path,
+            "compress": compress,
+            "sweeps": [{"context_id": c, "query": q, "next_page": 1, "done": False, "failures": 0}
+                       for c in context_ids for q in [None] + list(queries)],
+            "parts": [],
+            "entities_written": 0,
+            "composed": False
+        }
+        checkpoint = cls(bucket, key, state)
+        checkpoint.save()
+        return checkpoint
+
+    @property
+    def finished(self):
+        return all(sweep["done"] for sweep in self.state["sweeps"])
+
+    def save(self):
+        """Write the checkpoint, failing with PreconditionFailed if another invocation saved it first."""
+        blob = self.bucket.blob(f"{CHECKPOINT_PREFIX}{self.key}.json.gz")
+        state = dict(self.state, seen_ids=list(self.seen_ids))
+        content = gzip.compress(json.dumps(state, separators=(",", ":")).encode("utf-8"))
+        blob.upload_from_string(content, content_type="application/gzip",
+                                if_generation_match=self.generation or 0)
+        self.generation = blob.generation
+
+    def record_page(self, index, entities):
+        """Write a page's new entities to a part object, advance its sweep and save.
+
+        A page that adds no new ids ends the sweep, which also ends sweeps
+        over contexts the server does not paginate. The part is written
+        outside the lock under a name unique to the sweep and page, so sweeps
+        only serialise on the id filter and the checkpoint save.
+        """
+        sweep = self.state["sweeps"][index]
+        new = []
+        with self._lock:
+            for entity in entities:
+                if entity.get("id") not in self.seen_ids and entity.get("id") not in self.claimed_ids:
+                    self.claimed_ids.add(entity.get("id"))
+                    new.append(entity)
+        ids = [entity.get("id") for entity in new]
+        if new:
+            part_name = f"{PARTS_PREFIX}{self.key}/{index:03d}_{sweep['next_page']:05d}.ndjson"
+            part_name += ".gz" if self.state["compress"] else ""
+            try:
+                write_ndjson(self.bucket.blob(part_name), new, self.state["compress"])
+            except BaseException:
+                with self._lock:
+                    self.claimed_ids.difference_update(ids)
+                raise
+        with self._lock:
+            self.claimed_ids.difference_update(ids)
+            if new:
+                self.seen_ids.update(ids)
+                self.state["parts"].append(part_name)
+                self.state["entities_written"] += len(new)
+            sweep["failures"] = 0
+            sweep["done"] = not new or sweep["next_page"] >= MAX_PAGES
+            sweep["next_page"] += 1
+            self.save()
+        current_metrics().incr("pages_fetched")
+
+    def record_failure(self, index, error):
+        """Count a failed page; the sweep is given up after PAGE_MAX_FAILURES failures in a row."""
+        with self._lock:
+            sweep = self.state["sweeps"][index]
+            sweep["failures"] += 1
+            if sweep["failures"] >= PAGE_MAX_FAILURES:
+                logging.error("Giving up sweep %s/%s at page %d after %d failures: %s", sweep["context_id"],
+                              sweep["query"], sweep["next_page"], sweep["failures"], str(error))
+                sweep["done"] = True
+            self.save()
+
+    def compose(self):
+        """Compose the part objects into the destination object and mark the checkpoint composed."""
+        content_type = "application/gzip" if self.state["compress"] else "application/x-ndjson"
+        compose_parts(self.bucket, self.state["parts"], self.state["destination_path"], content_type,
+                      f"{PARTS_PREFIX}{self.key}/")
+        self.state["composed"] = True
+        self.save()
+        self._delete_objects(self.state["parts"])
+        self.state["parts"] = []
+
+    def delete(self):
+        """Remove the checkpoint and any part objects it still references."""
+        self._delete_objects(self.state["parts"] + [f"{CHECKPOINT_PREFIX}{self.key}.json.gz"])
+
+    def _delete_objects(self, names):
+        for name in names:
+            try:
+                self.bucket.blob(name).delete()
+            except gcs_exceptions.NotFound:
+                pass
+
+def run_sweep(checkpoint, index, deadline):
+    """Fetch the pages of one sweep until it is done, throttled, failing or out of time."""
+    sweep = checkpoint.state["sweeps"][index]
+    while not sweep["done"] and time.monotonic() < deadline:
+        payload = build_payload(sweep["context_id"], sweep["query"], sweep["next_page"])
+        try:
+            entities, _, _ = fetch_collections(payload)
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 429:
+                # Still throttled after the session's retries; the next invocation resumes this page
+                current_metrics().incr("throttled")
+                logging.warning("Throttled on %s page %d, leaving it for the next run",
+                                payload["variables"], sweep["next_page"])
+                return
+            checkpoint.record_failure(index, e)
+            logging.error("Failed to fetch %s page %d: %s", payload["variables"], sweep["next_page"], str(e))
+            return
+        except (requests.exceptions.RequestException, ValueError) as e:
+            checkpoint.record_failure(index, e)
+            logging.error("Failed to fetch %s page %d: %s", payload["variables"], sweep["next_page"], str(e))
+            return
+        checkpoint.record_page(index, entities)
+
+def run_sweeps(checkpoint, deadline):
+    """Advance every unfinished sweep of checkpoint concurrently until done or deadline."""
+    pending = [i for i, sweep in enumerate(checkpoint.state["sweeps"]) if not sweep["done"]]
+    if not pending:
+        return
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(pending))) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, run_sweep, checkpoint, i, deadline)
+                   for i in pending]
+        for future in futures:
+            future.result()
+
+class GCSJobQueue:
+    """Load job queue backed by one JSON object per job under a GCS outbox prefix."""
+
+    def __init__(self, bucket, prefix=OUTBOX_PREFIX):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def put(self, job):
+        """Enqueue a load job record and return its id. Ids sort in enqueue order."""
+        job_id = f"{datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f')}_{uuid.uuid4().hex[:8]}"
+        self.bucket.blob(f"{self.prefix}{job_id}.json").upload_from_string(
+            json.dumps(job), content_type="application/json")
+        return job_id
+
+class LocalJobQueue:
+    """Directory-backed stand-in for GCSJobQueue, for local runs and tests."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, job):
+        """Enqueue a load job record and return its id. Ids sort in enqueue order."""
+        job_id = f"{datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f')}_{uuid.uuid4().hex[:8]}"
+        # Write then rename so a concurrent drain never sees a partial record
+        path = os.path.join(self.directory, f"{job_id}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(job, f)
+        os.replace(path + ".tmp", path)
+        return job_id
+
+def get_job_queue(bucket):
+    """Return the configured load job queue."""
+    return LocalJobQueue(JOB_QUEUE_DIR) if JOB_QUEUE_DIR else GCSJobQueue(bucket)
+
 @functions_framework.http
+@instrumented
 def extract_to_gcs(request):
     """HTTP Cloud Function to scrape Coursera data, upload to GCS, and trigger load to BigQuery."""
-    entities = fetch_graphql_data()
-    if not entities:
-        logging.error("No data fetched from Coursera")
-        return json.dumps({
-            "status": "error",
-            "message": "Failed to fetch data from Coursera"
-        }), 500
+    request_json = request.get_json(silent=True) or {}
+    context_ids = request_json.get("context_ids")
+    queries = request_json.get("queries")
+    # "json" keeps the original pretty-printed array; "ndjson" streams records into GCS as they arrive
+    output_format = request_json.get("output_format", "json")
+    compress = request_json.get("compression") == "gzip"
+    # The response cache short-circuits runs where nothing changed upstream; "force" always uploads and loads
+    use_cache = request_json.get("use_cache", True)
+    force = request_json.get("force", False)
+    # "http" calls the load function and waits for it; "queue" enqueues a load job and returns immediately;
+    # "push" sends the rows straight to the load function's Storage Write API sink without a GCS file
+    handoff = request_json.get("handoff", "http")
+    # Paginated sweeps checkpoint every page to GCS and resume from it when re-invoked
+    paginate = request_json.get("paginate", False)
+    # Enrichment adds per-course details fetched in aliased batches, cached per id
+    enrich = request_json.get("enrich", False)
+    deadline = time.monotonic() + EXTRACT_TIME_BUDGET_SECONDS
 
     bucket_name = "zambara"
     # Add a timestamp to the filename to create a unique file
     timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-    destination_path = f"zambara/kere/coursera_courses_{timestamp}.json"
+    bucket = get_storage_client().bucket(bucket_name)
+    cache_bucket = bucket if use_cache else None
+    state = {"changed": force or not use_cache}
+    checkpoint = None
+    # An enriched snapshot is also stale once any of its details needs fetching again. Both that check
+    # and the enrichment use the detail cache, so it is read once for the run.
+    detail_cache = read_detail_cache(cache_bucket) if enrich and cache_bucket is not None else {}
+    outdated = functools.partial(details_outdated, cache=detail_cache) if enrich else None
+    unchanged_response = json.dumps({
+        "status": "unchanged",
+        "message": "Coursera data unchanged since the last run; skipped upload and load"
+    }), 200
 
-    try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(destination_path)
-        blob.upload_from_string(json.dumps(entities, indent=4), content_type="application/json")
-        logging.info("Uploaded data to gs://%s/%s", bucket_name, destination_path)
-    except Exception as e:
-        logging.error("Failed to upload to GCS: %s", str(e))
+    if handoff == "push":
+        try:
+            entities = wait_for_change(iter_graphql_entities(context_ids, queries, cache_bucket, state, enrich), state,
+                                       outdated)
+            if entities is None:
+                logging.info("All responses matched the cache, skipping push")
+                commit_cache_entries(bucket, state)
+                return unchanged_response
+            if enrich:
+                entities = enrich_entities(entities, cache_bucket, detail_cache)
+            with current_metrics().span("push"):
+                pushed, push_response = push_entities(entities, request_json.get("stream_type", "pending"))
+        except RuntimeError as e:
+            logging.error("No data fetched from Coursera: %s", str(e))
+            return json.dumps({
+                "status": "error",
+                "message": "Failed to fetch data from Coursera"
+            }), 500
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            logging.error("Failed to push rows to load_function: %s", str(e))
+            return json.dumps({
+                "status": "error",
+                "message": f"Failed to push rows to load_function: {str(e)}"
+            }), 500
+        current_metrics().incr("rows_pushed", pushed)
+        logging.info("Pushed %d entities to the load_function stream %s", pushed, push_response.get("stream"))
+        commit_cache_entries(bucket, state)
         return json.dumps({
-            "status": "error",
-            "message": f"Failed to upload to GCS: {str(e)}"
-        }), 500
+            "status": "success",
+            "message": f"Extracted Coursera data and pushed {pushed} entities to BigQuery",
+            "stream": push_response.get("stream"),
+            "rows_pushed": pushed
+        }), 200
+
+    if paginate:
+        # Pages are composed from NDJSON parts and always reloaded, so the response cache is not consulted
+        context_ids = context_ids or CONTEXT_IDS
+        queries = SEARCH_QUERIES if queries is None else queries
+        key = ExtractCheckpoint.key_for(context_ids, queries, compress)
+        try:
+            checkpoint = ExtractCheckpoint.load(bucket, key)
+            if checkpoint is None:
+                destination_path = f"zambara/kere/coursera_courses_{timestamp}.ndjson" + (".gz" if compress else "")
+                checkpoint = ExtractCheckpoint.start(bucket, key, context_ids, queries, destination_path, compress)
+            else:
+                logging.info("Resuming extract checkpoint %s with %d entities written",
+                             key, checkpoint.state["entities_written"])
+            if not checkpoint.state["composed"]:
+                run_sweeps(checkpoint, deadline)
+                if not checkpoint.finished:
+                    pending = sum(not sweep["done"] for sweep in checkpoint.state["sweeps"])
+                    logging.info("Checkpointed %d entities, %d sweeps left", checkpoint.state["entities_written"], pending)
+                    return json.dumps({
+                        "status": "partial",
+                        "message": "Extract checkpointed; invoke again to resume",
+                        "checkpoint": key,
+                        "entities_written": checkpoint.state["entities_written"],
+                        "sweeps_pending": pending
+                    }), 202
+                if not checkpoint.state["parts"]:
+                    logging.error("No data fetched from Coursera")
+                    checkpoint.delete()
+                    return json.dumps({
+                        "status": "error",
+                        "message": "Failed to fetch data from Coursera"
+                    }), 500
+                with current_metrics().span("compose"):
+                    checkpoint.compose()
+            destination_path = checkpoint.state["destination_path"]
+        except gcs_exceptions.PreconditionFailed:
+            logging.warning("Extract checkpoint %s was advanced by another invocation", key)
+            return json.dumps({
+                "status": "error",
+                "message": f"Extract checkpoint {key} is being resumed by another invocation"
+            }), 409
+        except Exception as e:
+            logging.error("Failed paginated extract: %s", str(e))
+            return json.dumps({
+                "status": "error",
+                "message": f"Failed paginated extract: {str(e)}"
+            }), 500
+        logging.info("Composed %d entities into gs://%s/%s", checkpoint.state["entities_written"], bucket_name,
+                     destination_path)
+    elif output_format == "ndjson":
+        destination_path = f"zambara/kere/coursera_courses_{timestamp}.ndjson" + (".gz" if compress else "")
+        try:
+            entities = wait_for_change(iter_graphql_entities(context_ids, queries, cache_bucket, state, enrich), state,
+                                       outdated)
+            if entities is None:
+                logging.info("All responses matched the cache, skipping upload and load")
+                commit_cache_entries(bucket, state)
+                return unchanged_response
+            if enrich:
+                entities = enrich_entities(entities, cache_bucket, detail_cache)
+            blob = bucket.blob(destination_path)
+            with current_metrics().span("stream_upload"):
+                count = write_ndjson(blob, entities, compress)
+        except RuntimeError as e:
+            logging.error("No data fetched from Coursera: %s", str(e))
+            return json.dumps({
+                "status": "error",
+                "message": "Failed to fetch data from Coursera"
+            }), 500
+        except Exception as e:
+            logging.error("Failed to upload to GCS: %s", str(e))
+            return json.dumps({
+                "status": "error",
+                "message": f"Failed to upload to GCS: {str(e)}"
+            }), 500
+        if not count:
+            logging.error("No data fetched from Coursera")
+            blob.delete()
+            return json.dumps({
+                "status": "error",
+                "message": "Failed to fetch data from Coursera"
+            }), 500
+        logging.info("Streamed %d records to gs://%s/%s", count, bucket_name, destination_path)
+    else:
+        entities = fetch_graphql_data(context_ids, queries, cache_bucket, state, enrich)
+        if not entities:
+            logging.error("No data fetched from Coursera")
+            return json.dumps({
+                "status": "error",
+                "message": "Failed to fetch data from Coursera"
+            }), 500
+        if not state["changed"] and not (outdated and outdated(entities)):
+            logging.info("All responses matched the cache, skipping upload and load")
+            commit_cache_entries(bucket, state)
+            return unchanged_response
+
+        destination_path = f"zambara/kere/coursera_courses_{timestamp}.json"
+
+        try:
+            if enrich:
+                entities = list(enrich_entities(entities, cache_bucket, detail_cache))
+            blob = bucket.blob(destination_path)
+            with current_metrics().span("serialise"):
+                content = json.dumps(entities, indent=4)
+            with current_metrics().span("upload"):
+                blob.upload_from_string(content, content_type="application/json")
+            current_metrics().incr("rows_written", len(entities))
+            current_metrics().incr("bytes_serialised", len(content))
+            logging.info("Uploaded data to gs://%s/%s", bucket_name, destination_path)
+        except Exception as e:
+            logging.error("Failed to upload to GCS: %s", str(e))
+            return json.dumps({
+                "status": "error",
+                "message": f"Failed to upload to GCS: {str(e)}"
+            }), 500
 
     gcs_uri = f"gs://{bucket_name}/{destination_path}"
 
     # Trigger the load_function (gcs_to_bigquery) via HTTP
-    load_function_url = "https://etl-kere-load-82546987242.us-central1.run.app"  # Replace with your load_function URL
+    load_function_url = LOAD_FUNCTION_URL  # Set LOAD_FUNCTION_URL to your load_function URL
     load_payload = {
         "gcs_uri": gcs_uri,
         "dataset_id": "ETL_pipeline_kere",
         "table_id": "coursera_courses",
-        "write_disposition": "WRITE_TRUNCATE"
+        "write_disposition": "WRITE_TRUNCATE",
+        "load_mode": request_json.get("load_mode", "pandas"),
+        "clean_engine": request_json.get("clean_engine", "python"),
+        "incremental": bool(request_json.get("incremental", False)),
+        "streaming": request_json.get("streaming"),
+        "shards": request_json.get("shards")
     }
 
+    if handoff == "queue":
+        try:
+            with current_metrics().span("trigger"):
+                job_id = get_job_queue(bucket).put(load_payload)
+        except Exception as e:
+            logging.error("Failed to enqueue load job: %s", str(e))
+            return json.dumps({
+                "status": "error",
+                "message": f"Failed to enqueue load job: {str(e)}"
+            }), 500
+        logging.info("Enqueued load job %s for %s", job_id, gcs_uri)
+        commit_cache_entries(bucket, state)
+        if checkpoint:
+            checkpoint.delete()
+        return json.dumps({
+            "status": "success",
+            "message": "Extracted Coursera data, uploaded to GCS, and queued load to BigQuery",
+            "gcs_uri": gcs_uri,
+            "job_id": job_id
+        }), 200
+
     try:
         # Use the same service account credentials for authentication
         # In Cloud Run, the default service account is used automatically
-        response = requests.post(
-            load_function_url,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {get_id_token()}"
-            },
-            json=load_payload
-        )
-        response.raise_for_status()
-        load_response = response.json()
+        with current_metrics().span("trigger"):
+            response = get_trigger_session().post(
+                load_function_url,
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {get_id_token(load_function_url)}"
+                },
+                json=load_payload,
+                timeout=LOAD_TRIGGER_TIMEOUT
+            )
+            response.raise_for_status()
+            load_response = response.json()
         logging.info("Triggered load_function: %s", load_response)
+        # Only remember these responses once the snapshot they produced has been handed to the load
+        commit_cache_entries(bucket, state)
+        if checkpoint:
+            checkpoint.delete()
         return json.dumps({
             "status": "success",
             "message": "Extracted Coursera data, uploaded to GCS, and triggered load to BigQuery",
@@ -109,14 +1207,22 @@ def extract_to_gcs(request):
             "message": f"Failed to trigger load_function: {str(e)}"
         }), 500
 
-def get_id_token():
-    """Get an ID token for authentication."""
-    import google.auth
-    import google.auth.transport.requests
-    creds, _ = google.auth.default()
-    request = google.auth.transport.requests.Request()
-    creds.refresh(request)
-    return creds.id_token
+_id_tokens = {}
+_id_token_lock = threading.Lock()
+# Refresh a cached ID token this many seconds before it expires
+ID_TOKEN_REFRESH_MARGIN = 300
+
+def get_id_token(audience=LOAD_FUNCTION_URL):
+    """Get an ID token for audience, cached until shortly before it expires."""
+    with _id_token_lock:
+        token, expiry = _id_tokens.get(audience, (None, 0))
+        if token is None or time.time() >= expiry - ID_TOKEN_REFRESH_MARGIN:
+            # Works with metadata-server and service-account credentials alike, unlike credentials.id_token
+            token = google.oauth2.id_token.fetch_id_token(google.auth.transport.requests.Request(), audience)
+            claims = google.auth.jwt.decode(token, verify=False)
+            expiry = claims.get("exp", time.time() + 3600)
+            _id_tokens[audience] = (token, expiry)
+        return token
 
 # import functions_framework
 # import requests
@@ -123,14 +123,303 @@
 
 
 import functions_framework
+import requests
 from google.cloud import storage
 from google.cloud import bigquery
 import json
-import pandas as pd
+import gzip
+import hashlib
 import logging
+import os
+import threading
+import datetime
+import fnmatch
+import re
+import time
+import uuid
+import contextlib
+import contextvars
+import codecs
+import functools
+import itertools
+import multiprocessing
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from google.api_core import exceptions as api_exceptions
+import google.auth.jwt
+import google.auth.transport.requests
+import google.oauth2.id_token
 
 logging.basicConfig(level=logging.INFO)
 
+PROJECT_ID = "vital-cathode-454012-k0"
+# Cleaned intermediate objects for server-side load jobs
+STAGING_PREFIX = "zambara/kere/staging/"
+# Per-table hash manifests of the last incremental load, keyed on row id
+MANIFEST_PREFIX = "zambara/kere/manifests/"
+# Load jobs queued by extract_to_gcs; JOB_QUEUE_DIR switches to a local directory queue
+QUEUE_BUCKET = "zambara"
+OUTBOX_PREFIX = "zambara/kere/outbox/"
+JOB_QUEUE_DIR = os.environ.get("JOB_QUEUE_DIR")
+# Snapshots written by extract_to_gcs and the worker pool used to backfill them
+SNAPSHOT_PREFIX = "zambara/kere/coursera_courses_"
+SNAPSHOT_DATE_PATTERN = re.compile(r"_(\d{8})_\d{6}\.")
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", "16"))
+# Resumable upload chunk size for staging objects (must be a multiple of 256 KiB)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Streaming loads read the snapshot in ranged chunks and clean it in bounded batches
+STREAM_CHUNK_SIZE = 8 * 1024 * 1024
+# A JSON array element that does not decode within this many characters is malformed, not truncated
+STREAM_MAX_ELEMENT_SIZE = 4 * STREAM_CHUNK_SIZE
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", "5000"))
+# Snapshots larger than this are streamed unless the request sets "streaming" explicitly
+STREAM_THRESHOLD_BYTES = int(os.environ.get("STREAM_THRESHOLD_BYTES", str(256 * 1024 * 1024)))
+
+# Sharded loads: a coordinator splits a snapshot into shards that workers clean and stage in parallel
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "8"))
+# "http" invokes this function once per shard at LOAD_FUNCTION_URL; "local" uses a process pool
+SHARD_DISPATCH = os.environ.get("SHARD_DISPATCH", "http")
+LOAD_FUNCTION_URL = os.environ.get("LOAD_FUNCTION_URL", "https://etl-kere-load-82546987242.us-central1.run.app")
+SHARD_TIMEOUT = float(os.environ.get("SHARD_TIMEOUT", "900"))
+SHARD_MANIFEST_PREFIX = "zambara/kere/manifests/shards/"
+
+SCHEMA = [
+    bigquery.SchemaField("type", "STRING"),
+    bigquery.SchemaField("id", "STRING"),
+    bigquery.SchemaField("name", "STRING"),
+    bigquery.SchemaField("slug", "STRING"),
+    bigquery.SchemaField("url", "STRING"),
+    bigquery.SchemaField("partners", "STRING"),
+    bigquery.SchemaField("difficulty", "STRING"),
+    bigquery.SchemaField("coursera_plus", "STRING"),
+    bigquery.SchemaField("image_url", "STRING"),
+    bigquery.SchemaField("course_count", "STRING")
+]
+
+# Modelled layout (load_mode "model"): typed course facts partitioned by snapshot date, a partner
+# dimension keyed by partner id and a course-partner bridge, named after the target table
+FACT_SCHEMA = [
+    bigquery.SchemaField("snapshot_date", "DATE"),
+    bigquery.SchemaField("type", "STRING"),
+    bigquery.SchemaField("id", "STRING"),
+    bigquery.SchemaField("name", "STRING"),
+    bigquery.SchemaField("slug", "STRING"),
+    bigquery.SchemaField("url", "STRING"),
+    bigquery.SchemaField("difficulty", "STRING"),
+    bigquery.SchemaField("coursera_plus", "BOOL"),
+    bigquery.SchemaField("image_url", "STRING"),
+    bigquery.SchemaField("course_count", "INT64"),
+    bigquery.SchemaField("partner_count", "INT64")
+]
+PARTNER_SCHEMA = [
+    bigquery.SchemaField("partner_id", "STRING"),
+    bigquery.SchemaField("name", "STRING"),
+    bigquery.SchemaField("logo", "STRING"),
+    bigquery.SchemaField("first_seen", "DATE"),
+    bigquery.SchemaField("last_seen", "DATE")
+]
+BRIDGE_SCHEMA = [
+    bigquery.SchemaField("snapshot_date", "DATE"),
+    bigquery.SchemaField("course_id", "STRING"),
+    bigquery.SchemaField("partner_id", "STRING"),
+    bigquery.SchemaField("position", "INT64")
+]
+
+# Push mode appends cleaned rows through the BigQuery Storage Write API to an append-only table;
+# ingested_at orders the versions of a course across pushes
+PUSH_TABLE_ID = "coursera_courses_stream"
+STREAM_SCHEMA = SCHEMA + [bigquery.SchemaField("ingested_at", "TIMESTAMP")]
+# An AppendRows request may carry at most 10 MB
+APPEND_MAX_BYTES = 8 * 1024 * 1024
+
+SERVICE_NAME = "load_function"
+
+# Optional export of run metrics: "prometheus" pushes them to PROMETHEUS_PUSHGATEWAY_URL,
+# "otel" records spans and counters through the OpenTelemetry API
+METRICS_EXPORTER = os.environ.get("METRICS_EXPORTER", "")
+PROMETHEUS_PUSHGATEWAY_URL = os.environ.get("PROMETHEUS_PUSHGATEWAY_URL", "")
+
+class RunMetrics:
+    """Timed spans and counters for one invocation, emitted as a single structured record."""
+
+    def __init__(self, service):
+        self.service = service
+        self.run_id = uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._tracer = otel_tracer() if METRICS_EXPORTER == "otel" else None
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """Time a stage. Repeated or concurrent spans with the same name accumulate."""
+        otel_span = self._tracer.start_as_current_span(name) if self._tracer else contextlib.nullcontext()
+        start = time.perf_counter()
+        try:
+            with otel_span:
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.spans[name] = self.spans.get(name, 0.0) + elapsed
+
+    def incr(self, name, value=1):
+        """Add value to a counter."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """Return the spans (in seconds) and counters recorded so far."""
+        with self._lock:
+            return {
+                "service": self.service,
+                "run_id": self.run_id,
+                "total_seconds": round(time.perf_counter() - self.started, 4),
+                "spans": {name: round(seconds, 4) for name, seconds in self.spans.items()},
+                "counters": dict(self.counters)
+            }
+
+    def emit(self):
+        """Write the summary as one structured log line and hand it to the configured exporter."""
+        summary = self.summary()
+        # A JSON line on stdout becomes a structured entry in Cloud Logging
+        print(json.dumps(dict(summary, severity="INFO", message="run metrics")), flush=True)
+        try:
+            if METRICS_EXPORTER == "prometheus" and PROMETHEUS_PUSHGATEWAY_URL:
+                push_prometheus(summary)
+            elif METRICS_EXPORTER == "otel":
+                record_otel_counters(summary)
+        except Exception as e:
+            logging.warning("Failed to export run metrics: %s", str(e))
+        return summary
+
+_current_metrics = contextvars.ContextVar("run_metrics", default=None)
+
+def current_metrics():
+    """Return the metrics of the running invocation, or a detached instance outside one."""
+    metrics = _current_metrics.get()
+    return metrics if metrics is not None else RunMetrics(SERVICE_NAME)
+
+def instrumented(handler):
+    """Run an HTTP handler under a fresh RunMetrics and attach the summary to its JSON response."""
+    @functools.wraps(handler)
+    def wrapper(request):
+        metrics = RunMetrics(SERVICE_NAME)
+        token = _current_metrics.set(metrics)
+        try:
+            body, status = handler(request)
+        finally:
+            _current_metrics.reset(token)
+            summary = metrics.emit()
+        try:
+            body = json.dumps(dict(json.loads(body), metrics=summary))
+        except (TypeError, ValueError):
+            pass
+        return body, status
+    return wrapper
+
+def prometheus_text(summary):
+    """Render a run summary in the Prometheus text exposition format."""
+    labels = f'service="{summary["service"]}"'
+    lines = ["# TYPE etl_stage_seconds gauge"]
+    lines += [f'etl_stage_seconds{{{labels},stage="{name}"}} {seconds}' for name, seconds in summary["spans"].items()]
+    lines += [f"etl_run_seconds{{{labels}}} {summary['total_seconds']}"]
+    lines += [f"etl_{name}{{{labels}}} {value}" for name, value in summary["counters"].items()]
+    return "\n".join(lines) + "\n"
+
+def push_prometheus(summary):
+    """Push a run summary to a Prometheus Pushgateway."""
+    url = f"{PROMETHEUS_PUSHGATEWAY_URL.rstrip('/')}/metrics/job/{summary['service']}"
+    request = urllib.request.Request(url, data=prometheus_text(summary).encode("utf-8"), method="PUT",
+                                     headers={"Content-Type": "text/plain; version=0.0.4"})
+    urllib.request.urlopen(request, timeout=5).close()
+
+def otel_tracer():
+    """Return an OpenTelemetry tracer, or None when the API is not installed."""
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        logging.warning("METRICS_EXPORTER=otel but opentelemetry-api is not installed")
+        return None
+    return trace.get_tracer(SERVICE_NAME)
+
+_otel_counters = {}
+
+def record_otel_counters(summary):
+    """Add a run's counters to OpenTelemetry counters of the same name."""
+    from opentelemetry import metrics
+    meter = metrics.get_meter(SERVICE_NAME)
+    for name, value in summary["counters"].items():
+        if name not in _otel_counters:
+            _otel_counters[name] = meter.create_counter(f"etl.{name}")
+        _otel_counters[name].add(value, {"service": summary["service"]})
+
+# Clients shared across invocations of a warm container, built on first use
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _get_client(name, factory):
+    """Return the shared client registered under name, building it on first use."""
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = factory()
+        return _clients[name]
+
+def get_storage_client():
+    """Return the shared Cloud Storage client."""
+    return _get_client("storage", storage.Client)
+
+def get_bigquery_client():
+    """Return the shared BigQuery client for PROJECT_ID."""
+    return _get_client("bigquery", lambda: bigquery.Client(project=PROJECT_ID))
+
+def get_write_client():
+    """Return the shared BigQuery Storage Write API client. The library is only imported when push is used."""
+    def build():
+        from google.cloud import bigquery_storage_v1
+        return bigquery_storage_v1.BigQueryWriteClient()
+    return _get_client("bigquery_write", build)
+
+def _build_session():
+    """Build a keep-alive session for shard worker calls. Shard staging is idempotent, so POSTs are retried."""
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=frozenset(["POST"]),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_maxsize=max(SHARD_COUNT, 10), max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_session():
+    """Return the shared keep-alive HTTP session."""
+    return _get_client("http", _build_session)
+
+def _reset_clients():
+    """Drop the clients inherited by a forked worker process; they are rebuilt on first use."""
+    global _clients, _clients_lock
+    _clients = {}
+    _clients_lock = threading.Lock()
+
+def warm_clients():
+    """Build the shared clients at container start so the first request does not pay for it."""
+    try:
+        get_storage_client()
+        get_bigquery_client()
+    except Exception as e:
+        logging.warning("Failed to warm clients, they will be built on first use: %s", str(e))
+
+warm_clients()
+
 def clean_data(entities):
     cleaned_data = []
     for entity in entities:
@@ -146,66 +435,559 @@ def clean_data(entities):
                 "difficulty": entity["difficultyLevel"],
                 "coursera_plus": "Yes" if entity["isPartOfCourseraPlus"] else "No",
                 "image_url": entity["imageUrl"],
-                "course_count": str(entity.get("courseCount", ""))
+                "course_count": "" if entity.get("courseCount") is None else str(entity["courseCount"])
             }
             cleaned_data.append(course_info)
         except KeyError as e:
             logging.error("Missing key in entity: %s, entity: %s", str(e), entity)
             continue
+        except (TypeError, AttributeError) as e:
+            # A null __typename, partner list or partner name
+            logging.error("Null field in entity: %s, entity: %s", str(e), entity)
+            continue
     return cleaned_data
 
-def load_to_bigquery(gcs_uri, dataset_id, table_id, write_disposition="WRITE_TRUNCATE"):
-    """Load data from GCS to BigQuery."""
+def parse_entities(content, file_name):
+    """Parse a snapshot written by extract: a JSON array, or NDJSON optionally gzip-compressed."""
+    if file_name.endswith(".gz"):
+        content = gzip.decompress(content)
+    if ".ndjson" in file_name:
+        return [json.loads(line) for line in content.splitlines() if line.strip()]
+    return json.loads(content.decode("utf-8"))
+
+def open_snapshot(blob, file_name):
+    """Open a snapshot for streaming reads. Returns (raw reader, decompressed stream)."""
+    reader = blob.open("rb", chunk_size=STREAM_CHUNK_SIZE)
+    if file_name.endswith(".gz"):
+        return reader, gzip.GzipFile(fileobj=reader, mode="rb")
+    return reader, reader
+
+def iter_ndjson(stream, read_size=STREAM_CHUNK_SIZE):
+    """Yield the records of an NDJSON stream, reading it read_size bytes at a time."""
+    remainder = b""
+    while True:
+        chunk = stream.read(read_size)
+        if not chunk:
+            break
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if remainder.strip():
+        yield json.loads(remainder)
+
+_ARRAY_SEPARATORS = re.compile(r"[\s,]*")
+
+def iter_json_array(stream, read_size=STREAM_CHUNK_SIZE, max_element_size=STREAM_MAX_ELEMENT_SIZE):
+    """Yield the elements of a top-level JSON array without holding the whole document.
+
+    Elements are decoded one at a time from a text window that only grows
+    past read_size when a single element is larger than that. An element
+    that still does not decode once the window holds more than
+    max_element_size characters is treated as malformed rather than
+    truncated, so a bad element cannot pull the rest of the snapshot into
+    memory.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    pos = 0
+    eof = False
+    started = False
+
+    while True:
+        pos = _ARRAY_SEPARATORS.match(buffer, pos).end()
+        if pos < len(buffer):
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("Snapshot is not a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                # Elements are objects, so a truncated one never decodes
+                element, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise
+                if len(buffer) - pos > max_element_size:
+                    raise ValueError(f"Malformed JSON array element, or one larger than {max_element_size} "
+                                     f"characters: {e}") from e
+            else:
+                yield element
+                continue
+        if eof:
+            raise ValueError("Unterminated JSON array in snapshot")
+        chunk = stream.read(read_size)
+        eof = not chunk
+        buffer = buffer[pos:] + utf8.decode(chunk, final=eof)
+        pos = 0
+
+def iter_entities(stream, file_name):
+    """Stream the entities of a snapshot opened with open_snapshot."""
+    if ".ndjson" in file_name:
+        return iter_ndjson(stream)
+    return iter_json_array(stream)
+
+def iter_batches(items, size=STREAM_BATCH_SIZE):
+    """Group an iterable into lists of at most size items."""
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def raw_arrow_schema():
+    """Arrow schema of the entity fields clean_data reads; everything else is ignored on parse."""
+    import pyarrow as pa
+    return pa.schema([
+        ("__typename", pa.string()),
+        ("id", pa.string()),
+        ("name", pa.string()),
+        ("slug", pa.string()),
+        ("url", pa.string()),
+        ("partners", pa.list_(pa.struct([("name", pa.string())]))),
+        ("difficultyLevel", pa.string()),
+        ("isPartOfCourseraPlus", pa.bool_()),
+        ("imageUrl", pa.string()),
+        ("courseCount", pa.int64())
+    ])
+
+def parse_entities_arrow(content, file_name):
+    """Parse a snapshot straight into an Arrow table with the raw entity schema."""
+    import io
+    import pyarrow as pa
+    import pyarrow.json as pa_json
+    if file_name.endswith(".gz"):
+        content = gzip.decompress(content)
+    if ".ndjson" in file_name:
+        parse_options = pa_json.ParseOptions(explicit_schema=raw_arrow_schema(),
+                                             unexpected_field_behavior="ignore")
+        return pa_json.read_json(io.BytesIO(content), parse_options=parse_options)
+    return pa.Table.from_pylist(json.loads(content.decode("utf-8")), schema=raw_arrow_schema())
+
+def clean_data_arrow(raw_table):
+    """Columnar equivalent of clean_data.
+
+    Returns (cleaned, rejects). Like clean_data, a row is rejected when its
+    __typename, its partners or a partner name is null; other null fields
+    are kept as null. Arrow reads a missing field as null, so rows that
+    clean_data rejects for a missing key other than those are kept here.
+    Rejects keep their raw columns.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    # Null partner lists, partners and partner names all make the joined names null
+    partners = raw_table["partners"].combine_chunks()
+    names = partners.values.flatten()[partners.type.value_type.get_field_index("name")]
+    partner_names = pc.binary_join(pa.ListArray.from_arrays(partners.offsets, names, mask=partners.is_null()), ", ")
+    valid = pc.and_(pc.is_valid(raw_table["__typename"]), pc.is_valid(partner_names))
+    rejects = raw_table.filter(pc.invert(valid))
+    table = raw_table.append_column("partner_names", pa.chunked_array([partner_names])).filter(valid)
+
+    cleaned = pa.table({
+        "type": pc.replace_substring(table["__typename"], "DiscoveryCollections_", ""),
+        "id": table["id"],
+        "name": table["name"],
+        "slug": table["slug"],
+        "url": table["url"],
+        "partners": table["partner_names"],
+        "difficulty": table["difficultyLevel"],
+        "coursera_plus": pc.if_else(pc.fill_null(table["isPartOfCourseraPlus"], False), "Yes", "No"),
+        "image_url": table["imageUrl"],
+        "course_count": pc.fill_null(pc.cast(table["courseCount"], pa.string()), "")
+    })
+    return cleaned, rejects
+
+def write_staging_parquet(bucket, path, table):
+    """Write an Arrow table to a GCS object as Parquet and return its gs:// URI."""
+    import pyarrow.parquet as pq
+    blob = bucket.blob(path)
+    with current_metrics().span("stage"):
+        with blob.open("wb", chunk_size=UPLOAD_CHUNK_SIZE, content_type="application/octet-stream") as writer:
+            pq.write_table(table, writer)
+    return f"gs://{bucket.name}/{path}"
+
+def write_staging_parquet_batches(bucket, path, tables):
+    """Write an iterable of Arrow tables to one GCS Parquet object, a row group per table."""
+    import pyarrow.parquet as pq
+    blob = bucket.blob(path)
+    with current_metrics().span("stage"):
+        with blob.open("wb", chunk_size=UPLOAD_CHUNK_SIZE, content_type="application/octet-stream") as writer:
+            parquet_writer = None
+            try:
+                for table in tables:
+                    if parquet_writer is None:
+                        parquet_writer = pq.ParquetWriter(writer, table.schema)
+                    parquet_writer.write_table(table)
+            finally:
+                if parquet_writer is not None:
+                    parquet_writer.close()
+    return f"gs://{bucket.name}/{path}"
+
+def split_gcs_uri(gcs_uri):
+    """Split gs://bucket/path into (bucket, path)."""
+    bucket_name, file_name = gcs_uri.replace("gs://", "").split("/", 1)
+    return bucket_name, file_name
+
+def write_staging_ndjson(bucket, path, rows):
+    """Write cleaned rows to a GCS object as NDJSON and return its gs:// URI."""
+    blob = bucket.blob(path)
+    with current_metrics().span("stage"):
+        with blob.open("wb", chunk_size=UPLOAD_CHUNK_SIZE, content_type="application/x-ndjson") as writer:
+            for row in rows:
+                writer.write(json.dumps(row, separators=(",", ":")).encode("utf-8"))
+                writer.write(b"\n")
+    return f"gs://{bucket.name}/{path}"
+
+def load_from_uri(bq_client, source_uris, table_ref, write_disposition,
+                  schema=None, source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON):
+    """Run a server-side BigQuery load job from GCS and wait for it to finish."""
+    job_config = bigquery.LoadJobConfig(
+        schema=SCHEMA if schema is None else schema,
+        write_disposition=write_disposition,
+        source_format=source_format
+    )
+    with current_metrics().span("bigquery_load"):
+        job = bq_client.load_table_from_uri(source_uris, table_ref, job_config=job_config)
+        job.result()
+    current_metrics().incr("rows_loaded", job.output_rows or 0)
+    logging.info("Load job %s wrote %s rows into %s", job.job_id, job.output_rows, table_ref)
+    return job
+
+def row_hash(row):
+    """Stable 64-bit content hash of a cleaned row."""
+    encoded = json.dumps(row, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+def read_manifest(bucket, path):
+    """Return the {id: hash} manifest stored at path, or None if there is none yet."""
+    blob = bucket.blob(path)
+    if not blob.exists():
+        return None
+    return json.loads(gzip.decompress(blob.download_as_string()))
+
+def write_manifest(bucket, path, hashes):
+    """Store an {id: hash} manifest as compact gzip-compressed JSON."""
+    content = gzip.compress(json.dumps(hashes, separators=(",", ":")).encode("utf-8"))
+    bucket.blob(path).upload_from_string(content, content_type="application/gzip")
+
+def table_modified(table):
+    """The table's last-modified time as stored in incremental manifests."""
+    return table.modified.isoformat() if table.modified else None
+
+def read_table_manifest(bq_client, bucket, table_ref):
+    """Return the {id: hash} manifest of table_ref's last incremental load, or None if it cannot be trusted.
+
+    The manifest records when the table was last modified by that load. Any
+    other write to the table since then (a full, sharded or manual load)
+    changes the table's modified time, so the manifest no longer describes
+    its contents and the next incremental load has to be a full one.
+    """
+    manifest_path = f"{MANIFEST_PREFIX}{table_ref}.json.gz"
+    manifest = read_manifest(bucket, manifest_path)
+    if manifest is None:
+        logging.info("No manifest at %s", manifest_path)
+        return None
+    try:
+        table = bq_client.get_table(table_ref)
+    except api_exceptions.NotFound:
+        logging.info("%s does not exist, ignoring the manifest at %s", table_ref, manifest_path)
+        return None
+    if manifest.get("table_modified") is None or manifest["table_modified"] != table_modified(table):
+        logging.info("%s was written outside incremental loads, ignoring the manifest at %s",
+                     table_ref, manifest_path)
+        return None
+    return manifest["hashes"]
+
+def write_table_manifest(bq_client, bucket, table_ref, hashes):
+    """Store the manifest of an incremental load together with the table's modified time after it."""
+    table = bq_client.get_table(table_ref)
+    write_manifest(bucket, f"{MANIFEST_PREFIX}{table_ref}.json.gz",
+                   {"table_modified": table_modified(table), "hashes": hashes})
+
+def diff_rows(rows, previous, hashes):
+    """Compare cleaned rows with the previous manifest as they stream past.
+
+    Yields delta rows: inserted or changed rows flagged _deleted = false, then
+    an id-only row flagged _deleted = true for every id that disappeared.
+    hashes is filled with the manifest for the current snapshot.
+    """
+    for row in rows:
+        digest = row_hash(row)
+        hashes[row["id"]] = digest
+        if previous.get(row["id"]) != digest:
+            yield dict(row, _deleted=False)
+    for row_id in previous:
+        if row_id not in hashes:
+            yield {"id": row_id, "_deleted": True}
+
+def merge_delta(bq_client, staging_uris, table_ref):
+    """Load one or more staged delta objects into a staging table and apply them to table_ref with one MERGE."""
+    staging_table = f"{table_ref}__delta"
+    load_from_uri(bq_client, staging_uris, staging_table, "WRITE_TRUNCATE",
+                  schema=SCHEMA + [bigquery.SchemaField("_deleted", "BOOL")])
+
+    columns = [field.name for field in SCHEMA]
+    query = f"""
+        MERGE `{table_ref}` T
+        USING `{staging_table}` S
+        ON T.id = S.id
+        WHEN MATCHED AND S._deleted THEN DELETE
+        WHEN MATCHED THEN UPDATE SET {", ".join(f"{c} = S.{c}" for c in columns)}
+        WHEN NOT MATCHED AND NOT S._deleted THEN
+          INSERT ({", ".join(columns)}) VALUES ({", ".join(f"S.{c}" for c in columns)})
+    """
+    with current_metrics().span("bigquery_merge"):
+        job = bq_client.query(query)
+        job.result()
+    bq_client.delete_table(staging_table, not_found_ok=True)
+    return job
+
+def load_incremental(bq_client, bucket, file_name, table_ref, rows):
+    """Apply only inserted, changed and deleted rows since the last incremental load.
+
+    rows may be any iterable and is consumed once, so only the {id: hash}
+    manifests are held in memory. Without a trusted manifest (see
+    read_table_manifest) the load is a full WRITE_TRUNCATE load. The
+    manifest is only replaced once the table has been updated.
+    """
+    staging_path = f"{STAGING_PREFIX}{file_name.rsplit('/', 1)[-1]}.delta.ndjson"
+    previous = read_table_manifest(bq_client, bucket, table_ref)
+    hashes = {}
+    delta_rows = 0
+
+    def hashed(rows):
+        for row in rows:
+            hashes[row["id"]] = row_hash(row)
+            yield row
+
+    def counted(rows):
+        nonlocal delta_rows
+        for row in rows:
+            delta_rows += 1
+            yield row
+
+    if previous is None:
+        staging_uri = write_staging_ndjson(bucket, staging_path, hashed(rows))
+    else:
+        staging_uri = write_staging_ndjson(bucket, staging_path, counted(diff_rows(rows, previous, hashes)))
+    try:
+        # An empty snapshot would otherwise delete every row of the table
+        if not hashes:
+            raise ValueError("No valid data after cleaning")
+        if previous is None:
+            logging.info("Running a full load of %s", table_ref)
+            load_from_uri(bq_client, staging_uri, table_ref, "WRITE_TRUNCATE")
+        else:
+            logging.info("Delta for %s: %d upserts and deletes out of %d rows", table_ref, delta_rows, len(hashes))
+            if delta_rows:
+                job = merge_delta(bq_client, staging_uri, table_ref)
+                logging.info("Merged delta into %s (%s rows affected)", table_ref, job.num_dml_affected_rows)
+    finally:
+        bucket.blob(staging_path).delete()
+    write_table_manifest(bq_client, bucket, table_ref, hashes)
+
+def load_dataframe(rows, table_ref):
+    """Load rows through pandas/to_gbq. pandas is only imported when this path is used."""
+    import pandas as pd
+    metrics = current_metrics()
+    with metrics.span("dataframe"):
+        df = pd.DataFrame(rows)
+    logging.info("Cleaned data: %d rows, columns: %s", len(df), df.columns.tolist())
+    with metrics.span("bigquery_load"):
+        df.to_gbq(table_ref, project_id=PROJECT_ID, if_exists="replace", table_schema=SCHEMA)
+    metrics.incr("rows_loaded", len(df))
+
+def iter_cleaned_batches(entities, clean_engine, totals, rejects):
+    """Clean streamed entities in batches of STREAM_BATCH_SIZE.
+
+    Yields lists of rows, or Arrow tables when clean_engine is "arrow", in
+    which case rejected rows are appended to rejects as Arrow tables. The
+    parsed and cleaned row counts are added to totals.
+    """
+    metrics = current_metrics()
+    for batch in iter_batches(entities):
+        totals["parsed"] += len(batch)
+        metrics.incr("rows_parsed", len(batch))
+        metrics.incr("batches")
+        with metrics.span("clean"):
+            if clean_engine == "arrow":
+                import pyarrow as pa
+                cleaned, batch_rejects = clean_data_arrow(pa.Table.from_pylist(batch, schema=raw_arrow_schema()))
+                if batch_rejects.num_rows:
+                    rejects.append(batch_rejects)
+            else:
+                cleaned = clean_data(batch)
+        totals["cleaned"] += len(cleaned)
+        metrics.incr("rows_cleaned", len(cleaned))
+        metrics.incr("rejects", len(batch) - len(cleaned))
+        yield cleaned
+
+def load_streaming(bq_client, bucket, file_name, table_ref, write_disposition, clean_engine, incremental):
+    """Load a snapshot without holding it in memory.
+
+    The object is read in STREAM_CHUNK_SIZE ranges, parsed one entity at a
+    time and cleaned in STREAM_BATCH_SIZE batches that are written straight
+    to a staging object, which one load job (or MERGE) then applies. Peak
+    memory is bounded by the batch size rather than the snapshot size.
+    Streaming always loads through staging; a pandas DataFrame would need
+    the whole table in memory. Returns the number of entities parsed.
+    """
+    metrics = current_metrics()
+    name = file_name.rsplit("/", 1)[-1]
+    totals = {"parsed": 0, "cleaned": 0}
+    rejects = []
+    reader, stream = open_snapshot(bucket.blob(file_name), file_name)
+    try:
+        with metrics.span("stream"):
+            batches = iter_cleaned_batches(iter_entities(stream, file_name), clean_engine, totals, rejects)
+            if incremental:
+                rows = itertools.chain.from_iterable(
+                    batch.to_pylist() if clean_engine == "arrow" else batch for batch in batches)
+                load_incremental(bq_client, bucket, file_name, table_ref, rows)
+            elif clean_engine == "arrow":
+                staging_path = f"{STAGING_PREFIX}{name}.cleaned.parquet"
+                staging_uri = write_staging_parquet_batches(bucket, staging_path, batches)
+            else:
+                staging_path = f"{STAGING_PREFIX}{name}.cleaned.ndjson"
+                staging_uri = write_staging_ndjson(bucket, staging_path, itertools.chain.from_iterable(batches))
+        metrics.incr("bytes_downloaded", reader.tell())
+    finally:
+        stream.close()
+        reader.close()
+    if rejects:
+        import pyarrow as pa
+        rejects_uri = write_staging_parquet(bucket, f"{STAGING_PREFIX}{name}.rejects.parquet", pa.concat_tables(rejects))
+        logging.warning("Rejected %d entities with missing fields, written to %s",
+                        sum(table.num_rows for table in rejects), rejects_uri)
+    if incremental:
+        return totals["parsed"]
+
+    try:
+        if not totals["cleaned"]:
+            raise ValueError("No valid data after cleaning")
+        if clean_engine == "arrow":
+            load_from_uri(bq_client, staging_uri, table_ref, write_disposition,
+                          source_format=bigquery.SourceFormat.PARQUET)
+        else:
+            load_from_uri(bq_client, staging_uri, table_ref, write_disposition)
+    finally:
+        bucket.blob(staging_path).delete()
+    return totals["parsed"]
+
+def load_to_bigquery(gcs_uri, dataset_id, table_id, write_disposition="WRITE_TRUNCATE", load_mode="pandas",
+                     clean_engine="python", incremental=False, streaming=None, shards=None, force=False):
+    """Load data from GCS to BigQuery.
+
+    load_mode "pandas" builds a DataFrame and calls to_gbq; "native" writes the
+    cleaned rows to a staging object and submits a BigQuery load job against it;
+    "model" loads the typed, partitioned layout instead (see load_model).
+    clean_engine "arrow" cleans with vectorized Arrow kernels and always loads
+    through a staging Parquet object. incremental applies only the rows that
+    changed since the previous incremental load, via a staging-table MERGE.
+    streaming parses and cleans the object in bounded batches instead of
+    downloading it whole (see load_streaming); None streams snapshots larger
+    than STREAM_THRESHOLD_BYTES. shards above 1 splits the load across
+    parallel workers (see load_sharded); force reloads a snapshot whose
+    sharded load was already committed.
+    """
     logging.info("Loading data from GCS URI: %s", gcs_uri)
+    metrics = current_metrics()
+
+    if load_mode == "model":
+        return load_model(gcs_uri, dataset_id, table_id)
+    if shards and int(shards) > 1:
+        return load_sharded(gcs_uri, dataset_id, table_id, write_disposition, clean_engine, incremental, int(shards),
+                            force=force)
+
+    if streaming is None:
+        try:
+            bucket_name, file_name = split_gcs_uri(gcs_uri)
+            blob = get_storage_client().bucket(bucket_name).get_blob(file_name)
+            streaming = blob is not None and (blob.size or 0) > STREAM_THRESHOLD_BYTES
+        except Exception as e:
+            logging.warning("Could not read the size of %s, loading it without streaming: %s", gcs_uri, str(e))
+            streaming = False
+    if streaming:
+        table_ref = f"{PROJECT_ID}.{dataset_id}.{table_id}"
+        try:
+            bucket_name, file_name = split_gcs_uri(gcs_uri)
+            bucket = get_storage_client().bucket(bucket_name)
+            bq_client = get_bigquery_client()
+            rows_parsed = load_streaming(bq_client, bucket, file_name, table_ref, write_disposition, clean_engine,
+                                         incremental)
+            table = bq_client.get_table(table_ref)
+            logging.info("Streamed %d entities from %s, table %s has %d rows",
+                         rows_parsed, file_name, table_ref, table.num_rows)
+            return table.num_rows
+        except Exception as e:
+            logging.error("Failed to stream GCS file into BigQuery: %s", str(e))
+            return f"Failed to stream GCS file into BigQuery: {str(e)}", 500
 
     # Download and parse the GCS file
     try:
-        uri_parts = gcs_uri.replace("gs://", "").split("/", 1)
-        bucket_name = uri_parts[0]
-        file_name = uri_parts[1]
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
+        bucket_name, file_name = split_gcs_uri(gcs_uri)
+        bucket = get_storage_client().bucket(bucket_name)
         blob = bucket.blob(file_name)
-        json_content = blob.download_as_string().decode("utf-8")
-        entities = json.loads(json_content)
-        logging.info("Successfully downloaded and parsed GCS file: %d entities", len(entities))
+        with metrics.span("download"):
+            content = blob.download_as_string()
+        metrics.incr("bytes_downloaded", len(content))
+        with metrics.span("parse"):
+            if clean_engine == "arrow":
+                raw_table = parse_entities_arrow(content, file_name)
+                rows_parsed = raw_table.num_rows
+            else:
+                entities = parse_entities(content, file_name)
+                rows_parsed = len(entities)
+        del content
+        metrics.incr("rows_parsed", rows_parsed)
+        logging.info("Successfully downloaded and parsed GCS file: %d entities", rows_parsed)
     except Exception as e:
         logging.error("Failed to download or parse GCS file: %s", str(e))
         return f"Failed to download or parse GCS file: {str(e)}", 500
 
     # Clean the data
-    cleaned_data = clean_data(entities)
-    if not cleaned_data:
+    with metrics.span("clean"):
+        if clean_engine == "arrow":
+            cleaned_data, rejects = clean_data_arrow(raw_table)
+        else:
+            cleaned_data = clean_data(entities)
+    metrics.incr("rows_cleaned", len(cleaned_data))
+    metrics.incr("rejects", rows_parsed - len(cleaned_data))
+    if clean_engine == "arrow":
+        if rejects.num_rows:
+            rejects_path = f"{STAGING_PREFIX}{file_name.rsplit('/', 1)[-1]}.rejects.parquet"
+            rejects_uri = write_staging_parquet(bucket, rejects_path, rejects)
+            logging.warning("Rejected %d entities with missing fields, written to %s", rejects.num_rows, rejects_uri)
+    if not len(cleaned_data):
         logging.error("No valid data after cleaning")
         return "No valid data after cleaning", 500
-    df = pd.DataFrame(cleaned_data)
-    logging.info("Cleaned data: %d rows, columns: %s", len(df), df.columns.tolist())
 
-    # BigQuery configuration
-    project_id = "vital-cathode-454012-k0"
     try:
-        bq_client = bigquery.Client(project=project_id)
-        table_ref = f"{project_id}.{dataset_id}.{table_id}"
-
-        schema = [
-            bigquery.SchemaField("type", "STRING"),
-            bigquery.SchemaField("id", "STRING"),
-            bigquery.SchemaField("name", "STRING"),
-            bigquery.SchemaField("slug", "STRING"),
-            bigquery.SchemaField("url", "STRING"),
-            bigquery.SchemaField("partners", "STRING"),
-            bigquery.SchemaField("difficulty", "STRING"),
-            bigquery.SchemaField("coursera_plus", "STRING"),
-            bigquery.SchemaField("image_url", "STRING"),
-            bigquery.SchemaField("course_count", "STRING")
-        ]
-
-        job_config = bigquery.LoadJobConfig(
-            schema=schema,
-            write_disposition=write_disposition,
-            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
-        )
-        df.to_gbq(table_ref, project_id=project_id, if_exists="replace", table_schema=schema)
+        bq_client = get_bigquery_client()
+        table_ref = f"{PROJECT_ID}.{dataset_id}.{table_id}"
+
+        if incremental:
+            rows = cleaned_data.to_pylist() if clean_engine == "arrow" else cleaned_data
+            load_incremental(bq_client, bucket, file_name, table_ref, rows)
+        elif clean_engine == "arrow":
+            staging_path = f"{STAGING_PREFIX}{file_name.rsplit('/', 1)[-1]}.cleaned.parquet"
+            staging_uri = write_staging_parquet(bucket, staging_path, cleaned_data)
+            load_from_uri(bq_client, staging_uri, table_ref, write_disposition,
+                          source_format=bigquery.SourceFormat.PARQUET)
+            bucket.blob(staging_path).delete()
+        elif load_mode == "native":
+            staging_path = f"{STAGING_PREFIX}{file_name.rsplit('/', 1)[-1]}.cleaned.ndjson"
+            staging_uri = write_staging_ndjson(bucket, staging_path, cleaned_data)
+            load_from_uri(bq_client, staging_uri, table_ref, write_disposition)
+            bucket.blob(staging_path).delete()
+        else:
+            load_dataframe(cleaned_data, table_ref)
         logging.info("Loaded %s into %s", file_name, table_ref)
 
         # Verify the number of rows loaded
@@ -216,12 +998,866 @@ def load_to_bigquery(gcs_uri, dataset_id, table_id, write_disposition="WRITE_TRU
         logging.error("Failed to load data into BigQuery: %s", str(e))
         return f"Failed to load data into BigQuery: {str(e)}", 500
 
+def list_snapshots(bucket, prefix=SNAPSHOT_PREFIX, pattern=None, start_date=None, end_date=None):
+    """List snapshot objects under prefix with paginated listing.
+
+    Objects are filtered by an optional glob on the object name and by the
+    snapshot date in their name (inclusive range of datetime.date). When a
+    day has several snapshots only the latest is kept. Returns a list of
+    (snapshot_date, object_name) sorted by date.
+    """
+    latest = {}
+    for blob in bucket.client.list_blobs(bucket.name, prefix=prefix, page_size=1000):
+        if pattern and not fnmatch.fnmatch(blob.name, pattern):
+            continue
+        match = SNAPSHOT_DATE_PATTERN.search(blob.name)
+        if not match:
+            continue
+        snapshot_date = datetime.datetime.strptime(match.group(1), "%Y%m%d").date()
+        if (start_date and snapshot_date < start_date) or (end_date and snapshot_date > end_date):
+            continue
+        # Names embed a sortable timestamp, so the greatest name is the day's latest snapshot
+        if snapshot_date not in latest or blob.name > latest[snapshot_date]:
+            latest[snapshot_date] = blob.name
+    return sorted(latest.items())
+
+def stage_snapshot(bucket, staging_prefix, snapshot_date, file_name):
+    """Stream, clean and stage one snapshot tagged with its date. Returns (staging URI, row count)."""
+    reader, stream = open_snapshot(bucket.blob(file_name), file_name)
+    row_count = 0
+
+    def tagged():
+        nonlocal row_count
+        for batch in iter_batches(iter_entities(stream, file_name)):
+            for row in clean_data(batch):
+                row_count += 1
+                yield dict(row, snapshot_date=snapshot_date.isoformat())
+
+    with reader, stream:
+        staging_uri = write_staging_ndjson(bucket, f"{staging_prefix}{file_name.rsplit('/', 1)[-1]}.ndjson", tagged())
+    return staging_uri, row_count
+
+def backfill_history(bucket, table_ref, snapshots):
+    """Rebuild the date partitions of table_ref covered by snapshots.
+
+    Snapshots are downloaded and cleaned concurrently on a bounded pool, loaded
+    into a staging table with a single load job, and swapped into the
+    snapshot_date partitioned history table in one transaction. Returns the
+    number of rows loaded.
+    """
+    bq_client = get_bigquery_client()
+    staging_prefix = f"{STAGING_PREFIX}backfill/{uuid.uuid4().hex}/"
+    with ThreadPoolExecutor(max_workers=min(BACKFILL_WORKERS, len(snapshots))) as executor:
+        # Each snapshot runs in a copy of this context so it records into the invocation's metrics
+        futures = [executor.submit(contextvars.copy_context().run, stage_snapshot, bucket, staging_prefix, *snapshot)
+                   for snapshot in snapshots]
+        staged = [future.result() for future in futures]
+
+    staging_table = f"{table_ref}__backfill"
+    load_from_uri(bq_client, [uri for uri, _ in staged], staging_table, "WRITE_TRUNCATE",
+                  schema=SCHEMA + [bigquery.SchemaField("snapshot_date", "DATE")])
+    query = f"""
+        CREATE TABLE IF NOT EXISTS `{table_ref}`
+        PARTITION BY snapshot_date
+        AS SELECT * FROM `{staging_table}` WHERE FALSE;
+        BEGIN TRANSACTION;
+        DELETE FROM `{table_ref}` WHERE snapshot_date IN (SELECT DISTINCT snapshot_date FROM `{staging_table}`);
+        INSERT INTO `{table_ref}` SELECT * FROM `{staging_table}`;
+        COMMIT TRANSACTION;
+    """
+    bq_client.query(query).result()
+    bq_client.delete_table(staging_table, not_found_ok=True)
+    for blob in bucket.client.list_blobs(bucket.name, prefix=staging_prefix):
+        blob.delete()
+    rows_loaded = sum(count for _, count in staged)
+    logging.info("Backfilled %d snapshots (%d rows) into %s", len(snapshots), rows_loaded, table_ref)
+    return rows_loaded
+
+def snapshot_date_of(file_name):
+    """Snapshot date embedded in an extract object name, or today (UTC) if it has none."""
+    match = SNAPSHOT_DATE_PATTERN.search(file_name)
+    if match:
+        return datetime.datetime.strptime(match.group(1), "%Y%m%d").date()
+    return datetime.datetime.utcnow().date()
+
+def model_entity(entity, snapshot_date):
+    """Split one entity into its typed fact row and its partners.
+
+    Returns (fact row, [(position, partner)]). Raises KeyError for the
+    missing fields clean_data rejects and for a partner without an id, and
+    TypeError or AttributeError for a null __typename, partner list, partner
+    or partner name, which clean_data rejects too.
+    """
+    partners = entity["partners"]
+    fact = {
+        "snapshot_date": snapshot_date,
+        "type": entity["__typename"].replace("DiscoveryCollections_", ""),
+        "id": entity["id"],
+        "name": entity["name"],
+        "slug": entity["slug"],
+        "url": entity["url"],
+        "difficulty": entity["difficultyLevel"],
+        "coursera_plus": bool(entity["isPartOfCourseraPlus"]),
+        "image_url": entity["imageUrl"],
+        "course_count": entity.get("courseCount"),
+        "partner_count": len(partners)
+    }
+    partner_ids = entity.get("partnerIds") or []
+    modelled = []
+    for position, partner in enumerate(partners):
+        # Older snapshots may lack partners[].id; partnerIds lists the same partners in order
+        partner_id = partner.get("id") or (partner_ids[position] if position < len(partner_ids) else None)
+        if partner_id is None:
+            raise KeyError("partners[%d].id" % position)
+        if partner["name"] is None:
+            raise TypeError("partners[%d].name is null" % position)
+        modelled.append((position, {"partner_id": str(partner_id), "name": partner["name"], "logo": partner.get("logo")}))
+    return fact, modelled
+
+def stage_model(bucket, staging_prefix, entities, snapshot_date):
+    """Stream entities into staging NDJSON objects for the fact, partner and bridge tables.
+
+    Facts and bridge rows are written as they are modelled; only the
+    deduplicated partners are held in memory. Returns ({table: staging URI}, fact rows).
+    """
+    metrics = current_metrics()
+    day = snapshot_date.isoformat()
+    partners = {}
+    facts = 0
+    writers = {}
+    uris = {}
+    try:
+        for table in ("fact", "bridge"):
+            uris[table] = f"gs://{bucket.name}/{staging_prefix}{table}.ndjson"
+            writers[table] = bucket.blob(f"{staging_prefix}{table}.ndjson").open(
+                "wb", chunk_size=UPLOAD_CHUNK_SIZE, content_type="application/x-ndjson")
+        for entity in entities:
+            try:
+                fact, modelled = model_entity(entity, day)
+            except KeyError as e:
+                metrics.incr("rejects")
+                logging.error("Missing key in entity: %s, entity id: %s", str(e), entity.get("id"))
+                continue
+            except (TypeError, AttributeError) as e:
+                # A null __typename, partner list, partner or partner name
+                metrics.incr("rejects")
+                logging.error("Null field in entity: %s, entity id: %s", str(e), entity.get("id"))
+                continue
+            writers["fact"].write(json.dumps(fact, separators=(",", ":")).encode("utf-8") + b"\n")
+            for position, partner in modelled:
+                bridge = {"snapshot_date": day, "course_id": fact["id"], "partner_id": partner["partner_id"],
+                          "position": position}
+                writers["bridge"].write(json.dumps(bridge, separators=(",", ":")).encode("utf-8") + b"\n")
+                partners[partner["partner_id"]] = partner
+            facts += 1
+    finally:
+        for writer in writers.values():
+            writer.close()
+    metrics.incr("rows_cleaned", facts)
+    metrics.incr("partners", len(partners))
+    rows = (dict(partner, first_seen=day, last_seen=day) for partner in partners.values())
+    uris["partners"] = write_staging_ndjson(bucket, f"{staging_prefix}partners.ndjson", rows)
+    return uris, facts
+
+def ddl_columns(schema):
+    return ", ".join(f"{field.name} {field.field_type}" for field in schema)
+
+def load_model(gcs_uri, dataset_id, table_id):
+    """Load a snapshot into the modelled layout named after table_id.
+
+    - {table_id}_fact: typed course rows partitioned by snapshot_date and
+      clustered on type and difficulty.
+    - {table_id}_partners: one row per partner id, upserted.
+    - {table_id}_course_partners: course/partner bridge, partitioned like the facts.
+
+    The snapshot is streamed into staging tables and applied in one
+    transaction that replaces its date partitions, so reloading a snapshot
+    is idempotent. Returns the number of fact rows, or an (error, 500) tuple.
+    """
+    metrics = current_metrics()
+    base_ref = f"{PROJECT_ID}.{dataset_id}.{table_id}"
+    refs = {"fact": f"{base_ref}_fact", "partners": f"{base_ref}_partners", "bridge": f"{base_ref}_course_partners"}
+    schemas = {"fact": FACT_SCHEMA, "partners": PARTNER_SCHEMA, "bridge": BRIDGE_SCHEMA}
+    try:
+        bucket_name, file_name = split_gcs_uri(gcs_uri)
+        bucket = get_storage_client().bucket(bucket_name)
+        bq_client = get_bigquery_client()
+        snapshot_date = snapshot_date_of(file_name)
+        staging_prefix = f"{STAGING_PREFIX}model/{uuid.uuid4().hex}/"
+        try:
+            reader, stream = open_snapshot(bucket.blob(file_name), file_name)
+            with reader, stream, metrics.span("model"):
+                uris, facts = stage_model(bucket, staging_prefix, iter_entities(stream, file_name), snapshot_date)
+                metrics.incr("bytes_downloaded", reader.tell())
+            if not facts:
+                raise ValueError("No valid data after cleaning")
+            for table, uri in uris.items():
+                load_from_uri(bq_client, uri, f"{refs[table]}__staging", "WRITE_TRUNCATE", schema=schemas[table])
+        finally:
+            for blob in bucket.client.list_blobs(bucket.name, prefix=staging_prefix):
+                blob.delete()
+
+        fact_columns = ", ".join(field.name for field in FACT_SCHEMA)
+        bridge_columns = ", ".join(field.name for field in BRIDGE_SCHEMA)
+        query = f"""
+            CREATE TABLE IF NOT EXISTS `{refs["fact"]}` ({ddl_columns(FACT_SCHEMA)})
+            PARTITION BY snapshot_date
+            CLUSTER BY type, difficulty;
+            CREATE TABLE IF NOT EXISTS `{refs["partners"]}` ({ddl_columns(PARTNER_SCHEMA)})
+            CLUSTER BY partner_id;
+            CREATE TABLE IF NOT EXISTS `{refs["bridge"]}` ({ddl_columns(BRIDGE_SCHEMA)})
+            PARTITION BY snapshot_date
+            CLUSTER BY partner_id, course_id;
+            BEGIN TRANSACTION;
+            DELETE FROM `{refs["fact"]}` WHERE snapshot_date = @snapshot_date;
+            INSERT INTO `{refs["fact"]}` ({fact_columns})
+              SELECT {fact_columns} FROM `{refs["fact"]}__staging`;
+            DELETE FROM `{refs["bridge"]}` WHERE snapshot_date = @snapshot_date;
+            INSERT INTO `{refs["bridge"]}` ({bridge_columns})
+              SELECT {bridge_columns} FROM `{refs["bridge"]}__staging`;
+            MERGE `{refs["partners"]}` T
+            USING `{refs["partners"]}__staging` S
+            ON T.partner_id = S.partner_id
+            WHEN MATCHED THEN UPDATE SET
+              name = S.name, logo = S.logo,
+              first_seen = LEAST(T.first_seen, S.first_seen), last_seen = GREATEST(T.last_seen, S.last_seen)
+            WHEN NOT MATCHED THEN
+              INSERT (partner_id, name, logo, first_seen, last_seen)
+              VALUES (S.partner_id, S.name, S.logo, S.first_seen, S.last_seen);
+            COMMIT TRANSACTION;
+        """
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("snapshot_date", "DATE", snapshot_date)])
+        with metrics.span("bigquery_merge"):
+            bq_client.query(query, job_config=job_config).result()
+        for ref in refs.values():
+            bq_client.delete_table(f"{ref}__staging", not_found_ok=True)
+        logging.info("Modelled %d courses from %s into %s (snapshot %s)", facts, file_name, refs["fact"], snapshot_date)
+        return facts
+    except Exception as e:
+        logging.error("Failed to load modelled tables from %s: %s", gcs_uri, str(e))
+        return f"Failed to load modelled tables from {gcs_uri}: {str(e)}", 500
+
+_id_tokens = {}
+_id_token_lock = threading.Lock()
+# Refresh a cached ID token this many seconds before it expires
+ID_TOKEN_REFRESH_MARGIN = 300
+
+def get_id_token(audience):
+    """Get an ID token for calling audience, cached until shortly before it expires."""
+    with _id_token_lock:
+        token, expiry = _id_tokens.get(audience, (None, 0))
+        if token is None or time.time() >= expiry - ID_TOKEN_REFRESH_MARGIN:
+            token = google.oauth2.id_token.fetch_id_token(google.auth.transport.requests.Request(), audience)
+            claims = google.auth.jwt.decode(token, verify=False)
+            expiry = claims.get("exp", time.time() + 3600)
+            _id_tokens[audience] = (token, expiry)
+        return token
+
+def iter_ndjson_range(reader, start, end, read_size=STREAM_CHUNK_SIZE):
+    """Yield the NDJSON records that start inside the byte range [start, end) of a seekable stream.
+
+    A record that straddles start belongs to the previous range, and the
+    last record that starts before end is read to its end.
+    """
+    offset = max(start - 1, 0)
+    reader.seek(offset)
+    # Reading from start - 1 makes the first (skipped) piece empty when a record starts exactly at start
+    skip = start > 0
+    remainder = b""
+    while True:
+        chunk = reader.read(read_size)
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop() if chunk else b""
+        for line in lines:
+            line_start = offset
+            offset += len(line) + 1
+            if skip:
+                skip = False
+                continue
+            if end is not None and line_start >= end:
+                return
+            if line.strip():
+                yield json.loads(line)
+        if not chunk:
+            return
+
+def plan_shards(blob, file_name, count, staging_prefix, clean_engine, incremental, previous_manifest=None):
+    """Split a snapshot into shard specs for stage_shard.
+
+    Uncompressed NDJSON is split into byte ranges, so every worker reads only
+    its part of the object. JSON arrays and gzip files cannot be split by
+    offset; their workers each stream the whole object and keep every
+    count-th record. previous_manifest is the path of the table's trusted
+    incremental manifest, if any, for the workers to diff against.
+    """
+    shard = {"gcs_uri": f"gs://{blob.bucket.name}/{file_name}", "count": count, "staging_prefix": staging_prefix,
+             "clean_engine": clean_engine, "incremental": incremental, "previous_manifest": previous_manifest}
+    if ".ndjson" in file_name and not file_name.endswith(".gz"):
+        blob.reload()
+        size = blob.size
+        bounds = [size * i // count for i in range(count + 1)]
+        return [dict(shard, index=i, start=bounds[i], end=bounds[i + 1]) for i in range(count)]
+    return [dict(shard, index=i) for i in range(count)]
+
+def stage_shard(shard):
+    """Clean one shard of a snapshot and write it to staging. Returns the shard's result.
+
+    With incremental set the shard's {id: hash} manifest is staged next to
+    its rows so the coordinator can combine them. When the shard also names
+    the table's previous manifest, only the rows that are new or changed
+    against it are staged, as NDJSON delta rows for merge_delta.
+    """
+    metrics = current_metrics()
+    bucket_name, file_name = split_gcs_uri(shard["gcs_uri"])
+    bucket = get_storage_client().bucket(bucket_name)
+    path = f"{shard['staging_prefix']}{shard['index']:05d}"
+    clean_engine = shard.get("clean_engine", "python")
+    totals = {"parsed": 0, "cleaned": 0}
+    rejects = []
+    hashes = {}
+    previous = read_manifest(bucket, shard["previous_manifest"])["hashes"] if shard.get("previous_manifest") else None
+    delta_rows = 0
+
+    def changed(rows):
+        nonlocal delta_rows
+        for row in rows:
+            digest = row_hash(row)
+            hashes[row["id"]] = digest
+            if previous.get(row["id"]) != digest:
+                delta_rows += 1
+                yield dict(row, _deleted=False)
+
+    def hashed(rows):
+        for row in rows:
+            hashes[row["id"]] = row_hash(row)
+            yield row
+
+    def hashed_tables(tables):
+        for table in tables:
+            for row in table.to_pylist():
+                hashes[row["id"]] = row_hash(row)
+            yield table
+
+    reader, stream = open_snapshot(bucket.blob(file_name), file_name)
+    with reader, stream:
+        if shard.get("start") is not None:
+            entities = iter_ndjson_range(reader, shard["start"], shard["end"])
+        else:
+            entities = itertools.islice(iter_entities(stream, file_name), shard["index"], None, shard["count"])
+        batches = iter_cleaned_batches(entities, clean_engine, totals, rejects)
+        if previous is not None:
+            rows = itertools.chain.from_iterable(
+                batch.to_pylist() if clean_engine == "arrow" else batch for batch in batches)
+            staging_uri = write_staging_ndjson(bucket, f"{path}.delta.ndjson", changed(rows))
+        elif clean_engine == "arrow":
+            staging_uri = write_staging_parquet_batches(
+                bucket, f"{path}.parquet", hashed_tables(batches) if shard.get("incremental") else batches)
+        else:
+            rows = itertools.chain.from_iterable(batches)
+            staging_uri = write_staging_ndjson(bucket, f"{path}.ndjson", hashed(rows) if shard.get("incremental") else rows)
+        metrics.incr("bytes_downloaded", reader.tell() - (shard.get("start") or 0))
+    if rejects:
+        import pyarrow as pa
+        write_staging_parquet(bucket, f"{path}.rejects.parquet", pa.concat_tables(rejects))
+    if shard.get("incremental"):
+        write_manifest(bucket, f"{path}.manifest.json.gz", hashes)
+    logging.info("Staged shard %d/%d of %s: %d of %d entities kept", shard["index"] + 1, shard["count"],
+                 file_name, totals["cleaned"], totals["parsed"])
+    return {
+        "index": shard["index"],
+        "staging_uri": staging_uri,
+        "manifest_path": f"{path}.manifest.json.gz" if shard.get("incremental") else None,
+        "delta_rows": delta_rows if previous is not None else None,
+        "rows_parsed": totals["parsed"],
+        "rows_cleaned": totals["cleaned"],
+        "counters": metrics.summary()["counters"]
+    }
+
+def dispatch_shard_http(shard):
+    """Stage a shard in a separate gcs_to_bigquery invocation and return its result."""
+    response = get_session().post(
+        LOAD_FUNCTION_URL,
+        headers={"Authorization": f"Bearer {get_id_token(LOAD_FUNCTION_URL)}"},
+        json={"shard": shard},
+        timeout=SHARD_TIMEOUT
+    )
+    response.raise_for_status()
+    return response.json()["shard"]
+
+def _stage_shard_in_process(shard):
+    # Run a shard in a pool process under its own metrics, returned with the result
+    token = _current_metrics.set(RunMetrics(SERVICE_NAME))
+    try:
+        return stage_shard(shard)
+    finally:
+        _current_metrics.reset(token)
+
+def run_shards(shards, dispatch):
+    """Stage every shard in parallel, through worker invocations ("http") or a process pool ("local")."""
+    if dispatch == "local":
+        # Fork so workers inherit the loaded module; the parent's clients must not be shared across processes
+        executor = ProcessPoolExecutor(max_workers=min(len(shards), os.cpu_count() or 1),
+                                       mp_context=multiprocessing.get_context("fork"), initializer=_reset_clients)
+        submit = lambda shard: executor.submit(_stage_shard_in_process, shard)
+    else:
+        executor = ThreadPoolExecutor(max_workers=len(shards))
+        submit = lambda shard: executor.submit(contextvars.copy_context().run, dispatch_shard_http, shard)
+    with executor:
+        futures = [submit(shard) for shard in shards]
+        results = [future.result() for future in futures]
+    # Fold the workers' counters into this invocation's metrics
+    metrics = current_metrics()
+    for result in results:
+        for name, value in result.pop("counters", {}).items():
+            metrics.incr(name, value)
+    return results
+
+def commit_shards(bq_client, bucket, results, table_ref, write_disposition, clean_engine, incremental,
+                  previous=None, staging_prefix=None):
+    """Apply all staged shards to table_ref in one BigQuery job.
+
+    A plain load, and an incremental load without a trusted manifest
+    (previous), is a single load job over every shard. Otherwise the shards
+    staged only their new and changed rows; the ids of previous that no
+    shard saw are staged under staging_prefix as deletions, and the delta is
+    applied with one merge_delta MERGE, or not at all when nothing changed.
+    Incremental loads then replace the manifest with the union of the
+    shards' manifests. Returns the BigQuery job, or None.
+    """
+    source_uris = [result["staging_uri"] for result in results]
+    source_format = (bigquery.SourceFormat.PARQUET if clean_engine == "arrow"
+                     else bigquery.SourceFormat.NEWLINE_DELIMITED_JSON)
+    if not incremental:
+        return load_from_uri(bq_client, source_uris, table_ref, write_disposition, source_format=source_format)
+
+    hashes = {}
+    for result in results:
+        hashes.update(read_manifest(bucket, result["manifest_path"]))
+    if previous is None:
+        logging.info("Running a full load of %s", table_ref)
+        job = load_from_uri(bq_client, source_uris, table_ref, "WRITE_TRUNCATE", source_format=source_format)
+    else:
+        source_uris = [result["staging_uri"] for result in results if result["delta_rows"]]
+        deleted = [row_id for row_id in previous if row_id not in hashes]
+        if deleted:
+            source_uris.append(write_staging_ndjson(bucket, f"{staging_prefix}deletions.ndjson",
+                                                    ({"id": row_id, "_deleted": True} for row_id in deleted)))
+        delta_rows = sum(result["delta_rows"] for result in results) + len(deleted)
+        logging.info("Delta for %s: %d upserts and deletes out of %d rows", table_ref, delta_rows, len(hashes))
+        job = None
+        if delta_rows:
+            job = merge_delta(bq_client, source_uris, table_ref)
+            logging.info("Merged %d shards into %s (%s rows affected)", len(results), table_ref,
+                         job.num_dml_affected_rows)
+    write_table_manifest(bq_client, bucket, table_ref, hashes)
+    return job
+
+def load_sharded(gcs_uri, dataset_id, table_id, write_disposition="WRITE_TRUNCATE", clean_engine="python",
+                 incremental=False, shard_count=SHARD_COUNT, dispatch=SHARD_DISPATCH, force=False):
+    """Coordinate a sharded load of one snapshot.
+
+    The snapshot is split into shard_count shards that are cleaned and staged
+    in parallel, then committed together in one BigQuery job, so the table
+    only ever sees all shards or none. A completion manifest records the
+    commit; a snapshot that already has one is not loaded again unless force
+    is set. Returns the table's row count, or an (error, 500) tuple.
+    """
+    metrics = current_metrics()
+    table_ref = f"{PROJECT_ID}.{dataset_id}.{table_id}"
+    try:
+        bucket_name, file_name = split_gcs_uri(gcs_uri)
+        bucket = get_storage_client().bucket(bucket_name)
+        bq_client = get_bigquery_client()
+        completion_path = f"{SHARD_MANIFEST_PREFIX}{table_ref}/{file_name.rsplit('/', 1)[-1]}.json"
+        completion_blob = bucket.blob(completion_path)
+        if not force and completion_blob.exists():
+            logging.info("%s was already committed to %s, see %s", gcs_uri, table_ref, completion_path)
+            return bq_client.get_table(table_ref).num_rows
+
+        staging_prefix = f"{STAGING_PREFIX}shards/{uuid.uuid4().hex}/"
+        previous = read_table_manifest(bq_client, bucket, table_ref) if incremental else None
+        shards = plan_shards(bucket.blob(file_name), file_name, shard_count, staging_prefix, clean_engine, incremental,
+                             None if previous is None else f"{MANIFEST_PREFIX}{table_ref}.json.gz")
+        logging.info("Staging %s as %d shards (%s dispatch)", gcs_uri, len(shards), dispatch)
+        try:
+            with metrics.span("shards"):
+                results = run_shards(shards, dispatch)
+            if not sum(result["rows_cleaned"] for result in results):
+                raise ValueError("No valid data after cleaning")
+            job = commit_shards(bq_client, bucket, results, table_ref, write_disposition, clean_engine, incremental,
+                                previous, staging_prefix)
+        finally:
+            for blob in bucket.client.list_blobs(bucket.name, prefix=staging_prefix):
+                if not blob.name.endswith(".rejects.parquet"):
+                    blob.delete()
+
+        completion_blob.upload_from_string(json.dumps({
+            "gcs_uri": gcs_uri,
+            "table_ref": table_ref,
+            "job_id": job.job_id if job else None,
+            "committed_at": datetime.datetime.utcnow().isoformat() + "Z",
+            "shards": [{key: result[key] for key in ("index", "rows_parsed", "rows_cleaned")} for result in results]
+        }), content_type="application/json")
+        table = bq_client.get_table(table_ref)
+        logging.info("Committed %d shards of %s into %s (%d rows)", len(results), gcs_uri, table_ref, table.num_rows)
+        return table.num_rows
+    except Exception as e:
+        logging.error("Failed sharded load of %s: %s", gcs_uri, str(e))
+        return f"Failed sharded load of {gcs_uri}: {str(e)}", 500
+
+# Protobuf field types of the BigQuery column types used here (TIMESTAMP is epoch microseconds)
+_PROTO_FIELD_TYPES = {"STRING": "TYPE_STRING", "TIMESTAMP": "TYPE_INT64", "INT64": "TYPE_INT64",
+                      "BOOL": "TYPE_BOOL", "DATE": "TYPE_INT32", "FLOAT64": "TYPE_DOUBLE"}
+
+@functools.lru_cache(maxsize=None)
+def row_message_class(fields):
+    """Build a protobuf message class with one optional field per (name, BigQuery type) in fields."""
+    from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+    file_proto = descriptor_pb2.FileDescriptorProto(name="course_row.proto", package="etl", syntax="proto2")
+    message = file_proto.message_type.add(name="CourseRow")
+    for number, (name, field_type) in enumerate(fields, start=1):
+        message.field.add(name=name, number=number,
+                          label=descriptor_pb2.FieldDescriptorProto.LABEL_OPTIONAL,
+                          type=getattr(descriptor_pb2.FieldDescriptorProto, _PROTO_FIELD_TYPES[field_type]))
+    pool = descriptor_pool.DescriptorPool()
+    pool.AddSerializedFile(file_proto.SerializeToString())
+    descriptor = pool.FindMessageTypeByName("etl.CourseRow")
+    if hasattr(message_factory, "GetMessageClass"):
+        return message_factory.GetMessageClass(descriptor)
+    return message_factory.MessageFactory(pool).GetPrototype(descriptor)
+
+class StorageWriteSink:
+    """Append rows to a BigQuery table through the Storage Write API in batched protobuf requests.
+
+    stream_type "committed" makes every append visible as soon as it is
+    acknowledged; "pending" holds the appends until commit() makes them
+    visible atomically. Every append carries its row offset, so an append
+    that BigQuery already holds (a retry) is acknowledged without writing it
+    twice. Passing stream_name and offset continues an existing stream.
+    """
+
+    def __init__(self, table_ref, schema=STREAM_SCHEMA, stream_type="committed", stream_name=None, offset=0):
+        from google.cloud.bigquery_storage_v1 import types
+        self.types = types
+        self.client = get_write_client()
+        self.parent = self.client.table_path(*table_ref.split("."))
+        self.stream_type = stream_type
+        self.message_class = row_message_class(tuple((field.name, field.field_type) for field in schema))
+        if stream_name is None:
+            write_stream = types.WriteStream(type_=types.WriteStream.Type[stream_type.upper()])
+            stream_name = self.client.create_write_stream(parent=self.parent, write_stream=write_stream).name
+        self.stream_name = stream_name
+        self.offset = offset
+        self._stream = None
+
+    def _open(self):
+        from google.cloud.bigquery_storage_v1 import writer
+        from google.protobuf import descriptor_pb2
+        descriptor = descriptor_pb2.DescriptorProto()
+        self.message_class.DESCRIPTOR.CopyToProto(descriptor)
+        template = self.types.AppendRowsRequest(
+            write_stream=self.stream_name,
+            proto_rows=self.types.AppendRowsRequest.ProtoData(
+                writer_schema=self.types.ProtoSchema(proto_descriptor=descriptor)))
+        return writer.AppendRowsStream(self.client, template)
+
+    def append(self, rows):
+        """Append rows in requests of up to APPEND_MAX_BYTES. Returns the stream offset after them."""
+        batch = []
+        size = 0
+        for row in rows:
+            serialised = self.message_class(**{k: v for k, v in row.items() if v is not None}).SerializeToString()
+            if batch and size + len(serialised) > APPEND_MAX_BYTES:
+                self._send(batch)
+                batch = []
+                size = 0
+            batch.append(serialised)
+            size += len(serialised)
+        if batch:
+            self._send(batch)
+        return self.offset
+
+    def _send(self, serialised_rows):
+        if self._stream is None:
+            self._stream = self._open()
+        request = self.types.AppendRowsRequest(
+            offset=self.offset,
+            proto_rows=self.types.AppendRowsRequest.ProtoData(
+                rows=self.types.ProtoRows(serialized_rows=serialised_rows)))
+        metrics = current_metrics()
+        with metrics.span("storage_write_append"):
+            try:
+                self._stream.send(request).result()
+            except api_exceptions.AlreadyExists:
+                # An earlier attempt of this append already wrote these offsets
+                metrics.incr("duplicate_appends")
+        self.offset += len(serialised_rows)
+        metrics.incr("rows_appended", len(serialised_rows))
+
+    def commit(self):
+        """Finalize the stream and, for a pending stream, commit its rows to the table atomically."""
+        self.close()
+        self.client.finalize_write_stream(name=self.stream_name)
+        if self.stream_type == "pending":
+            response = self.client.batch_commit_write_streams(self.types.BatchCommitWriteStreamsRequest(
+                parent=self.parent, write_streams=[self.stream_name]))
+            if response.stream_errors:
+                raise RuntimeError("Failed to commit %s: %s" % (self.stream_name, response.stream_errors))
+
+    def close(self):
+        """Close the append connection; the stream itself stays open for later pushes."""
+        if self._stream is not None and self._stream.is_active:
+            self._stream.close()
+        self._stream = None
+
+def ensure_stream_table(bq_client, table_ref):
+    """Create the append-only push table, partitioned by ingestion day, if it does not exist."""
+    table = bigquery.Table(table_ref, schema=STREAM_SCHEMA)
+    table.time_partitioning = bigquery.TimePartitioning(field="ingested_at")
+    bq_client.create_table(table, exists_ok=True)
+
+def push_rows(table_ref, entities, stream_type="committed", stream_name=None, offset=0, commit=False):
+    """Clean pushed entities and append them to table_ref through the Storage Write API.
+
+    A push without stream_name only opens a new write stream and must carry
+    no rows, so a retried open can at worst leave an empty stream behind.
+    Every push with rows passes the stream and offset returned by the
+    previous one, which makes retrying it safe, and the last push sets
+    commit. Returns the state for the next push.
+    """
+    if stream_name is None:
+        if entities or commit:
+            raise ValueError("Open a write stream with an empty push before pushing rows")
+        ensure_stream_table(get_bigquery_client(), table_ref)
+        sink = StorageWriteSink(table_ref, STREAM_SCHEMA, stream_type)
+        logging.info("Opened %s write stream %s", stream_type, sink.stream_name)
+        return {"stream": sink.stream_name, "next_offset": 0, "rows_appended": 0, "committed": False}
+    with current_metrics().span("clean"):
+        rows = clean_data(entities)
+    current_metrics().incr("rows_cleaned", len(rows))
+    current_metrics().incr("rejects", len(entities) - len(rows))
+    ingested_at = int(time.time() * 1000000)
+    sink = StorageWriteSink(table_ref, STREAM_SCHEMA, stream_type, stream_name, offset)
+    try:
+        sink.append(dict(row, ingested_at=ingested_at) for row in rows)
+        if commit:
+            sink.commit()
+    finally:
+        sink.close()
+    logging.info("Appended %d rows to %s at offset %d%s", len(rows), sink.stream_name, offset,
+                 ", committed" if commit else "")
+    return {"stream": sink.stream_name, "next_offset": sink.offset, "rows_appended": len(rows), "committed": commit}
+
+class GCSJobQueue:
+    """Load job queue backed by one JSON object per job under a GCS outbox prefix."""
+
+    def __init__(self, bucket, prefix=OUTBOX_PREFIX):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def list(self, limit=None):
+        """Return up to limit pending (job_id, job) pairs, oldest first."""
+        jobs = []
+        for blob in self.bucket.client.list_blobs(self.bucket.name, prefix=self.prefix):
+            if not blob.name.endswith(".json"):
+                continue
+            jobs.append((blob.name[len(self.prefix):-len(".json")], json.loads(blob.download_as_bytes())))
+            if limit and len(jobs) >= limit:
+                break
+        return jobs
+
+    def delete(self, job_id):
+        """Acknowledge a job. A job already removed by another drain is ignored."""
+        blob = self.bucket.blob(f"{self.prefix}{job_id}.json")
+        try:
+            blob.delete()
+        except Exception as e:
+            logging.warning("Failed to delete queued job %s: %s", job_id, str(e))
+
+class LocalJobQueue:
+    """Directory-backed stand-in for GCSJobQueue, for local runs and tests."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def list(self, limit=None):
+        """Return up to limit pending (job_id, job) pairs, oldest first."""
+        jobs = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(self.directory, name)) as f:
+                jobs.append((name[:-len(".json")], json.load(f)))
+            if limit and len(jobs) >= limit:
+                break
+        return jobs
+
+    def delete(self, job_id):
+        """Acknowledge a job. A job already removed by another drain is ignored."""
+        try:
+            os.remove(os.path.join(self.directory, f"{job_id}.json"))
+        except FileNotFoundError:
+            pass
+
+def get_job_queue():
+    """Return the configured load job queue."""
+    if JOB_QUEUE_DIR:
+        return LocalJobQueue(JOB_QUEUE_DIR)
+    return GCSJobQueue(get_storage_client().bucket(QUEUE_BUCKET))
+
+def coalesce_jobs(jobs):
+    """Batch queued jobs into the loads that need to run, in enqueue order.
+
+    Jobs are grouped by target table and layout (modelled or flat). Every
+    snapshot is a full catalogue, so the latest replacing (WRITE_TRUNCATE or
+    incremental) flat job for a table supersedes all older jobs for it; only
+    WRITE_APPEND jobs queued after it are loaded individually. Model loads
+    only replace the partitions of their own snapshot date, so each of them
+    is loaded. Returns a list of (job_ids, job) pairs.
+    """
+    groups = {}
+    for job_id, job in jobs:
+        # pandas and native loads write the same flat table; model loads write the modelled tables
+        key = (job.get("dataset_id", "ETL_pipeline_kere"), job.get("table_id", "coursera_courses"),
+               job.get("load_mode") == "model")
+        groups.setdefault(key, []).append((job_id, job))
+
+    batches = []
+    for (_, _, modelled), group in groups.items():
+        if modelled:
+            batches.extend(([job_id], job) for job_id, job in group)
+            continue
+        replacing = [i for i, (_, job) in enumerate(group)
+                     if job.get("incremental") or job.get("write_disposition", "WRITE_TRUNCATE") != "WRITE_APPEND"]
+        if replacing:
+            last = replacing[-1]
+            batches.append(([job_id for job_id, _ in group[:last + 1]], group[last][1]))
+            group = group[last + 1:]
+        batches.extend(([job_id], job) for job_id, job in group)
+    return batches
+
+def drain_load_jobs(queue, max_jobs=None):
+    """Run the loads for all pending queued jobs and acknowledge the ones that succeeded.
+
+    A failed load stops further loads for the same table so that its jobs are
+    retried, in order, on the next drain.
+    """
+    jobs = queue.list(max_jobs)
+    logging.info("Draining %d queued load jobs", len(jobs))
+    results = []
+    failed_tables = set()
+    for job_ids, job in coalesce_jobs(jobs):
+        dataset_id = job.get("dataset_id", "ETL_pipeline_kere")
+        table_id = job.get("table_id", "coursera_courses")
+        if (dataset_id, table_id) in failed_tables:
+            continue
+        rows_loaded = load_to_bigquery(job["gcs_uri"], dataset_id, table_id,
+                                       job.get("write_disposition", "WRITE_TRUNCATE"),
+                                       job.get("load_mode", "pandas"),
+                                       job.get("clean_engine", "python"),
+                                       bool(job.get("incremental", False)),
+                                       job.get("streaming"),
+                                       job.get("shards"))
+        if isinstance(rows_loaded, tuple):  # Error occurred
+            failed_tables.add((dataset_id, table_id))
+            results.append({"gcs_uri": job["gcs_uri"], "jobs": job_ids, "status": "error", "message": rows_loaded[0]})
+            continue
+        for job_id in job_ids:
+            queue.delete(job_id)
+        results.append({"gcs_uri": job["gcs_uri"], "jobs": job_ids, "status": "success", "rows_loaded": rows_loaded})
+    return results
+
 @functions_framework.http
+@instrumented
 def gcs_to_bigquery(request):
     """HTTP Cloud Function to load data from GCS to BigQuery."""
     # Parse request parameters
     request_json = request.get_json(silent=True)
 
+    # Drain mode loads everything extract_to_gcs has queued since the last drain
+    if request_json and request_json.get("drain"):
+        try:
+            results = drain_load_jobs(get_job_queue(), request_json.get("max_jobs"))
+        except Exception as e:
+            logging.error("Failed to drain queued load jobs: %s", str(e))
+            return json.dumps({
+                "status": "error",
+                "message": f"Failed to drain queued load jobs: {str(e)}"
+            }), 500
+        failed = [r for r in results if r["status"] == "error"]
+        return json.dumps({
+            "status": "error" if failed else "success",
+            "message": f"Ran {len(results)} loads for queued jobs, {len(failed)} failed",
+            "loads": results
+        }), 500 if failed else 200
+
+    # Push mode appends rows sent by extract_to_gcs straight to BigQuery, without a GCS file or load job
+    if request_json and "push" in request_json:
+        push = request_json["push"]
+        dataset_id = push.get("dataset_id", "ETL_pipeline_kere")
+        table_id = push.get("table_id", PUSH_TABLE_ID)
+        table_ref = f"{PROJECT_ID}.{dataset_id}.{table_id}"
+        try:
+            result = push_rows(table_ref, push.get("entities", []), push.get("stream_type", "committed"),
+                               push.get("stream"), int(push.get("offset", 0)), bool(push.get("commit", False)))
+        except Exception as e:
+            logging.error("Failed to push rows to %s: %s", table_ref, str(e))
+            return json.dumps({
+                "status": "error",
+                "message": f"Failed to push rows to {table_ref}: {str(e)}"
+            }), 500
+        return json.dumps(dict(result, status="success",
+                               message=f"Appended {result['rows_appended']} rows to {dataset_id}.{table_id}")), 200
+
+    # Shard mode is one worker of a sharded load: clean and stage the shard, the coordinator commits it
+    if request_json and "shard" in request_json:
+        shard = request_json["shard"]
+        try:
+            result = stage_shard(shard)
+        except Exception as e:
+            logging.error("Failed to stage shard %s of %s: %s", shard.get("index"), shard.get("gcs_uri"), str(e))
+            return json.dumps({
+                "status": "error",
+                "message": f"Failed to stage shard: {str(e)}"
+            }), 500
+        return json.dumps({
+            "status": "success",
+            "message": f"Staged shard {shard['index']} with {result['rows_cleaned']} rows",
+            "shard": result
+        }), 200
+
+    # Backfill mode rebuilds a date-partitioned history table from stored snapshots
+    if request_json and "backfill" in request_json:
+        backfill = request_json["backfill"] or {}
+        dataset_id = request_json.get("dataset_id", "ETL_pipeline_kere")
+        table_id = request_json.get("table_id", "coursera_courses_history")
+        table_ref = f"{PROJECT_ID}.{dataset_id}.{table_id}"
+        try:
+            bucket = get_storage_client().bucket(backfill.get("bucket", QUEUE_BUCKET))
+            parse_date = lambda value: datetime.date.fromisoformat(value) if value else None
+            snapshots = list_snapshots(bucket, backfill.get("prefix", SNAPSHOT_PREFIX), backfill.get("glob"),
+                                       parse_date(backfill.get("start_date")), parse_date(backfill.get("end_date")))
+            if not snapshots:
+                return json.dumps({
+                    "status": "error",
+                    "message": "No snapshots match the backfill filter"
+                }), 404
+            rows_loaded = backfill_history(bucket, table_ref, snapshots)
+        except Exception as e:
+            logging.error("Failed to backfill %s: %s", table_ref, str(e))
+            return json.dumps({
+                "status": "error",
+                "message": f"Failed to backfill {table_ref}: {str(e)}"
+            }), 500
+        return json.dumps({
+            "status": "success",
+            "message": f"Backfilled {len(snapshots)} snapshots into BigQuery table {dataset_id}.{table_id}",
+            "snapshots": len(snapshots),
+            "rows_loaded": rows_loaded
+        }), 200
+
     if not request_json or "gcs_uri" not in request_json:
         logging.error("Missing 'gcs_uri' parameter in request")
         return json.dumps({
@@ -233,15 +1869,22 @@ def gcs_to_bigquery(request):
     dataset_id = request_json.get("dataset_id", "ETL_pipeline_kere")
     table_id = request_json.get("table_id", "coursera_courses")
     write_disposition = request_json.get("write_disposition", "WRITE_TRUNCATE")
+    load_mode = request_json.get("load_mode", "pandas")
+    clean_engine = request_json.get("clean_engine", "python")
+    incremental = bool(request_json.get("incremental", False))
+    streaming = request_json.get("streaming")
+    shards = request_json.get("shards")
+    force = bool(request_json.get("force", False))
 
     # Load to BigQuery
     logging.info("Loading data from %s to BigQuery table %s.%s", gcs_uri, dataset_id, table_id)
     try:
-        rows_loaded = load_to_bigquery(gcs_uri, dataset_id, table_id, write_disposition)
-        if isinstance(rows_loaded, str):  # Error occurred
+        rows_loaded = load_to_bigquery(gcs_uri, dataset_id, table_id, write_disposition, load_mode, clean_engine,
+                                       incremental, streaming, shards, force)
+        if isinstance(rows_loaded, tuple):  # Error occurred
             return json.dumps({
                 "status": "error",
-                "message": rows_loaded
+                "message": rows_loaded[0]
             }), 500
         logging.info("Loaded %d rows to BigQuery table %s.%s", rows_loaded, dataset_id, table_id)
         return json.dumps({
@@ -0,0 +1,17 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+@pytest.fixture(scope="session")
+def load_main():
+    """The load function's main.py, imported by path since both services name their module main."""
+    if "load_main" not in sys.modules:
+        spec = importlib.util.spec_from_file_location("load_main", MAIN_PATH)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["load_main"] = module
+        spec.loader.exec_module(module)
+    return sys.modules["load_main"]
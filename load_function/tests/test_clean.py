@@ -0,0 +1,91 @@
+import datetime
+import io
+import json
+
+import pytest
+
+BASE = {
+    "__typename": "DiscoveryCollections_course",
+    "name": "Course",
+    "slug": "course",
+    "url": "/learn/course",
+    "partners": [{"id": "p1", "name": "Stanford"}, {"id": "p2", "name": "DeepLearning.AI"}],
+    "difficultyLevel": "BEGINNER",
+    "isPartOfCourseraPlus": True,
+    "imageUrl": "https://example.com/image.png",
+    "courseCount": 4
+}
+
+CASES = {
+    "complete": {},
+    "null_partners": {"partners": None},
+    "empty_partners": {"partners": []},
+    "null_partner": {"partners": [{"id": "p1", "name": "Stanford"}, None]},
+    "null_partner_name": {"partners": [{"id": "p1", "name": None}]},
+    "null_typename": {"__typename": None},
+    "null_coursera_plus": {"isPartOfCourseraPlus": None},
+    "false_coursera_plus": {"isPartOfCourseraPlus": False},
+    "null_course_count": {"courseCount": None},
+    "missing_course_count": {"courseCount": ...},
+    "zero_course_count": {"courseCount": 0},
+    "null_image_url": {"imageUrl": None},
+}
+
+def make_entities():
+    entities = []
+    for case, overrides in CASES.items():
+        entity = dict(BASE, id=case, **overrides)
+        entities.append({key: value for key, value in entity.items() if value is not ...})
+    return entities
+
+@pytest.mark.parametrize("file_name", ["snapshot.json", "snapshot.ndjson"])
+def test_engines_clean_the_same_rows(load_main, file_name):
+    pytest.importorskip("pyarrow")
+    entities = make_entities()
+    if file_name.endswith(".ndjson"):
+        content = b"".join(json.dumps(entity).encode("utf-8") + b"\n" for entity in entities)
+    else:
+        content = json.dumps(entities, indent=4).encode("utf-8")
+
+    rows = load_main.clean_data(load_main.parse_entities(content, file_name))
+    cleaned, rejects = load_main.clean_data_arrow(load_main.parse_entities_arrow(content, file_name))
+
+    assert cleaned.to_pylist() == rows
+    kept = {row["id"] for row in rows}
+    assert sorted(rejects["id"].to_pylist()) == sorted(entity["id"] for entity in entities
+                                                       if entity["id"] not in kept)
+    assert sorted(rejects["id"].to_pylist()) == ["null_partner", "null_partner_name", "null_partners",
+                                                 "null_typename"]
+
+class MemoryBucket:
+    """Just enough of a Bucket for stage_model: objects are kept in a dict when closed."""
+
+    name = "bucket"
+
+    def __init__(self):
+        self.objects = {}
+
+    def blob(self, name):
+        bucket = self
+
+        class Writer(io.BytesIO):
+            def close(self):
+                bucket.objects[name] = self.getvalue()
+                super().close()
+
+        class Blob:
+            def open(self, mode, **kwargs):
+                return Writer()
+
+        return Blob()
+
+def test_model_rejects_the_entities_clean_data_rejects(load_main):
+    entities = make_entities()
+    kept = sorted(row["id"] for row in load_main.clean_data(entities))
+    bucket = MemoryBucket()
+
+    _, facts = load_main.stage_model(bucket, "staging/", entities, datetime.date(2025, 4, 1))
+
+    fact_ids = [json.loads(line)["id"] for line in bucket.objects["staging/fact.ndjson"].splitlines()]
+    assert facts == len(kept)
+    assert sorted(fact_ids) == kept
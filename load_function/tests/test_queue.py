@@ -0,0 +1,52 @@
+import json
+
+def job(uri, **fields):
+    return dict({"gcs_uri": uri}, **fields)
+
+def batches(load_main, jobs):
+    return [(job_ids, job["gcs_uri"]) for job_ids, job in load_main.coalesce_jobs(list(enumerate(jobs)))]
+
+def test_latest_replacing_job_supersedes_older_ones(load_main):
+    jobs = [job("a"), job("b", write_disposition="WRITE_APPEND"), job("c", incremental=True), job("d")]
+    assert batches(load_main, jobs) == [([0, 1, 2, 3], "d")]
+
+def test_append_jobs_after_the_last_replacing_job_load_individually(load_main):
+    jobs = [job("a", write_disposition="WRITE_APPEND"), job("b"), job("c", write_disposition="WRITE_APPEND"),
+            job("d", write_disposition="WRITE_APPEND")]
+    assert batches(load_main, jobs) == [([0, 1], "b"), ([2], "c"), ([3], "d")]
+
+def test_append_only_jobs_are_not_coalesced(load_main):
+    jobs = [job("a", write_disposition="WRITE_APPEND"), job("b", write_disposition="WRITE_APPEND")]
+    assert batches(load_main, jobs) == [([0], "a"), ([1], "b")]
+
+def test_pandas_and_native_jobs_share_the_flat_table(load_main):
+    jobs = [job("a", load_mode="native"), job("b", load_mode="pandas")]
+    assert batches(load_main, jobs) == [([0, 1], "b")]
+
+def test_model_jobs_never_coalesce(load_main):
+    jobs = [job("a", load_mode="model"), job("b"), job("c", load_mode="model"), job("d", load_mode="native")]
+    assert sorted(batches(load_main, jobs)) == [([0], "a"), ([1, 3], "d"), ([2], "c")]
+
+def test_tables_coalesce_separately(load_main):
+    jobs = [job("a"), job("b", table_id="other"), job("c"), job("d", dataset_id="other")]
+    assert sorted(batches(load_main, jobs)) == [([0, 2], "c"), ([1], "b"), ([3], "d")]
+
+def test_drain_stops_a_table_after_its_first_failure(load_main, tmp_path, monkeypatch):
+    jobs = [job("gs://b/a", write_disposition="WRITE_APPEND"), job("gs://b/b", table_id="other"),
+            job("gs://b/c", write_disposition="WRITE_APPEND"), job("gs://b/d", write_disposition="WRITE_APPEND")]
+    for i, queued in enumerate(jobs):
+        (tmp_path / f"{i:04d}.json").write_text(json.dumps(queued))
+    loaded = []
+
+    def load_to_bigquery(gcs_uri, *args):
+        loaded.append(gcs_uri)
+        return ("Failed to load", 500) if gcs_uri == "gs://b/a" else 10
+
+    monkeypatch.setattr(load_main, "load_to_bigquery", load_to_bigquery)
+    queue = load_main.LocalJobQueue(str(tmp_path))
+    results = load_main.drain_load_jobs(queue)
+
+    assert loaded == ["gs://b/a", "gs://b/b"]
+    assert [(r["gcs_uri"], r["status"]) for r in results] == [("gs://b/a", "error"), ("gs://b/b", "success")]
+    # The failed job and the jobs queued behind it for the same table stay queued, in order
+    assert [job_id for job_id, _ in queue.list()] == ["0000", "0002", "0003"]
@@ -0,0 +1,55 @@
+import io
+import json
+
+import pytest
+
+RECORDS = [{"id": f"s~{i}", "name": name} for i, name in enumerate(
+    ["plain", "Café ☕", "東京大学の講座", "🎓🎓🎓", "", "quote \" and \\n escape", "x" * 40, "ümlaut"])]
+DATA = b"".join(json.dumps(r, ensure_ascii=False).encode("utf-8") + b"\n" for r in RECORDS)
+
+class FakeBlob:
+    """Just enough of a Blob for plan_shards."""
+
+    class bucket:
+        name = "bucket"
+
+    def __init__(self, size):
+        self.size = size
+
+    def reload(self):
+        pass
+
+def read_shards(load_main, data, bounds, read_size):
+    records = []
+    for start, end in bounds:
+        records.extend(load_main.iter_ndjson_range(io.BytesIO(data), start, end, read_size=read_size))
+    return records
+
+@pytest.mark.parametrize("count", range(1, 14))
+def test_plan_shards_covers_the_object(load_main, count):
+    shards = load_main.plan_shards(FakeBlob(len(DATA)), "snapshot.ndjson", count, "staging/", "python", False)
+    assert [shard["index"] for shard in shards] == list(range(count))
+    assert shards[0]["start"] == 0 and shards[-1]["end"] == len(DATA)
+    assert all(a["end"] == b["start"] for a, b in zip(shards, shards[1:]))
+
+@pytest.mark.parametrize("file_name", ["snapshot.json", "snapshot.ndjson.gz", "snapshot.json.gz"])
+def test_plan_shards_strides_unsplittable_snapshots(load_main, file_name):
+    shards = load_main.plan_shards(FakeBlob(len(DATA)), file_name, 3, "staging/", "python", False)
+    assert [(shard["index"], shard.get("start")) for shard in shards] == [(0, None), (1, None), (2, None)]
+
+@pytest.mark.parametrize("count", range(1, 14))
+@pytest.mark.parametrize("read_size", [1, 2, 3, 5, 8, 13, 64, 1000])
+def test_planned_ranges_read_every_record_once(load_main, count, read_size):
+    shards = load_main.plan_shards(FakeBlob(len(DATA)), "snapshot.ndjson", count, "staging/", "python", False)
+    assert read_shards(load_main, DATA, [(s["start"], s["end"]) for s in shards], read_size) == RECORDS
+
+@pytest.mark.parametrize("read_size", [1, 4, 1000])
+def test_every_split_point_reads_every_record_once(load_main, read_size):
+    # Includes splits inside multibyte characters and exactly on record boundaries
+    for split in range(len(DATA) + 1):
+        assert read_shards(load_main, DATA, [(0, split), (split, len(DATA))], read_size) == RECORDS
+
+def test_range_without_trailing_newline(load_main):
+    data = DATA.rstrip(b"\n")
+    for split in range(len(data) + 1):
+        assert read_shards(load_main, data, [(0, split), (split, len(data))], 3) == RECORDS
@@ -0,0 +1,63 @@
+import io
+import json
+
+import pytest
+
+ENTITIES = [
+    {"id": "s~1", "name": "Café au lait ☕", "partners": [{"name": "東京大学"}], "courseCount": 3},
+    {"id": "s~2", "name": "Ünïcödé é́ 🎓", "partners": [], "imageUrl": None},
+    {"id": "s~3", "name": "brackets ] [ and \"quotes\", commas", "partners": [{"name": "a,b"}]},
+    {"id": "s~4", "nested": {"list": [1, 2, {"deep": [True, False, None]}]}, "partners": []},
+]
+
+READ_SIZES = list(range(1, 64)) + [97, 256, 1000]
+
+class CountingStream(io.BytesIO):
+    """A BytesIO that records how many bytes have been read from it."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+@pytest.mark.parametrize("read_size", READ_SIZES)
+@pytest.mark.parametrize("indent", [None, 4])
+def test_iter_json_array_matches_json_loads(load_main, read_size, indent):
+    data = json.dumps(ENTITIES, indent=indent, ensure_ascii=False).encode("utf-8")
+    assert list(load_main.iter_json_array(io.BytesIO(data), read_size=read_size)) == ENTITIES
+
+@pytest.mark.parametrize("document", [b"[]", b" [ ] ", b"\n[\n]\n"])
+def test_iter_json_array_empty(load_main, document):
+    assert list(load_main.iter_json_array(io.BytesIO(document), read_size=1)) == []
+
+def test_iter_json_array_rejects_non_arrays(load_main):
+    with pytest.raises(ValueError):
+        list(load_main.iter_json_array(io.BytesIO(b'{"id": "s~1"}')))
+
+@pytest.mark.parametrize("read_size", [1, 7, 1000])
+def test_iter_json_array_truncated(load_main, read_size):
+    data = json.dumps(ENTITIES).encode("utf-8")[:-10]
+    with pytest.raises(ValueError):
+        list(load_main.iter_json_array(io.BytesIO(data), read_size=read_size))
+
+def test_iter_json_array_malformed_element_stays_bounded(load_main):
+    valid = json.dumps(ENTITIES[0])
+    data = ("[" + valid + ', {"id": tru}, ' + ", ".join([valid] * 10000) + "]").encode("utf-8")
+    stream = CountingStream(data)
+    elements = load_main.iter_json_array(stream, read_size=64, max_element_size=256)
+    assert next(elements) == ENTITIES[0]
+    with pytest.raises(ValueError):
+        next(elements)
+    # Gave up after a few windows instead of buffering the remaining ~1 MB
+    assert stream.bytes_read < 64 * 8
+
+@pytest.mark.parametrize("read_size", READ_SIZES)
+@pytest.mark.parametrize("trailing_newline", [True, False])
+def test_iter_ndjson_matches_json_loads(load_main, read_size, trailing_newline):
+    data = b"\n".join(json.dumps(e, ensure_ascii=False).encode("utf-8") for e in ENTITIES)
+    data = data.replace(b"\n", b"\n\n", 1) + (b"\n" if trailing_newline else b"")
+    assert list(load_main.iter_ndjson(io.BytesIO(data), read_size=read_size)) == ENTITIES